@@ -0,0 +1,53 @@
+import BoulderMatrix, numpy as np
+
+# Action indices follow PolicyIteration: 0 right, 1 left, 2 up/none
+
+def play(policy, n_games, n, b_down, collisions, rng=None, record_states=False, progress=None, max_turns=None):
+    """Plays n_games alien-meteorite games at once, advancing every live game one turn per step.
+    Parameters:
+        policy: CompiledPolicy giving the action of every full state index
+        n_games: number of games
+        n: number of rows/columns
+        b_down: [B, K] next boulder state indices for each boulder state index
+        collisions: boolean array over full state indices
+        rng: numpy Generator, a fresh one is created when None
+        record_states: also return the full state indices visited by each game
+        progress: optional callback given the number of games that just ended
+        max_turns: optional cap on turns per game, for policies that can survive forever.
+            Games still alive after max_turns end with a score of max_turns and death state -1
+    Returns: array of scores and list of death state indices, or the visited
+        state indices of every game when record_states is True
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    b_down = np.asarray(b_down); collisions = np.asarray(collisions)
+    nB, n_next = b_down.shape
+    moves = BoulderMatrix.alien_movement_table(n)
+
+    alien = rng.integers(0, n, size=n_games)
+    boulders = np.full(n_games, nB-1) # empty state so no boulders to start
+    games = np.arange(n_games) # games still alive
+    scores = np.zeros(n_games, dtype=np.int64)
+    deaths = np.zeros(n_games, dtype=np.int64)
+    history = []; turn = 0
+    while len(games) and turn != max_turns:
+        actions = policy.act_many(alien*nB+boulders, rng)
+        alien = moves[alien, actions]
+        boulders = b_down[boulders, rng.integers(0, n_next, size=len(games))]
+        states = alien*nB+boulders
+        dead = collisions[states]
+        if record_states:
+            history.append((games, states))
+        scores[games[~dead]] += 1
+        deaths[games[dead]] = states[dead]
+        games = games[~dead]; alien = alien[~dead]; boulders = boulders[~dead]
+        if progress is not None and dead.any():
+            progress(int(dead.sum()))
+        turn += 1
+    deaths[games] = -1 # survived every turn
+    if progress is not None and len(games):
+        progress(len(games))
+    if not record_states:
+        return scores, deaths
+    game_ids = np.concatenate([g for g, s in history]); visited = np.concatenate([s for g, s in history])
+    order = np.argsort(game_ids, kind='stable') # turn order is kept within each game
+    return scores, np.split(visited[order], np.cumsum(np.bincount(game_ids, minlength=n_games))[:-1])
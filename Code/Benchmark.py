@@ -0,0 +1,112 @@
+import BoulderMatrix, MovementRewards, PolicyIteration, ParallelSimulation, SimulationNoVisual, numpy as np
+import argparse, json, platform, time, tracemalloc, datetime, os
+
+# Times and memory profiles each stage of the pipeline for a grid of environments.
+# Timings are the best of `repeat` runs without tracing; memory is the tracemalloc
+# peak of one extra traced run. Results are saved as JSON baselines, and --compare
+# flags any stage that is slower or larger than the baseline by more than --tolerance.
+# Start-state randomness makes the single GameLoop timing the noisiest of the stages.
+
+NOISE = {'seconds':0.005, 'peak_mb':0.5} # absolute changes below these are never regressions
+
+def measure(func, repeat=3):
+    """Runs func repeat times for timing and once more under tracemalloc
+    Returns: dictionary of best seconds and peak MB, and the value of the last call"""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter(); result = func(); times.append(time.perf_counter()-start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds':min(times), 'peak_mb':peak/2**20}, result
+
+def bench_config(n, n_boulders, n_games=10000, repeat=3, g=.5, t=0.05):
+    """Benchmarks every stage for one environment
+    Parameters:
+        n: number of rows/columns
+        n_boulders: number of boulders/meteorites per row
+        n_games: games per policy in the Simulations stage
+        repeat: timed runs per stage
+        g, t: gamma and theta of the solve
+    Returns: dictionary of stage to measurements
+    """
+    results = {}
+    results['BoulderMatrix.main'], model = measure(lambda: BoulderMatrix.main(n, n_boulders), repeat)
+    B, b_down, state_space, boulder_positions, alien_positions, collisions, state_reward, full_states = model
+    results['MovementRewards.main'], movement_rewards = measure(lambda: MovementRewards.main(n, full_states), repeat)
+    P, R = PolicyIteration.transition_matrices(n, b_down, state_reward)
+    results['PolicyIteration.policy_improvement'], solved = measure(
+        lambda: PolicyIteration.policy_improvement(P, R, g=g, t=t), repeat)
+    RL_Policies = np.argmax(solved[0], axis=1)
+    SimulationNoVisual.setup(n, n_boulders, policy=RL_Policies) # plays the policy solved above, no artifact is written
+    results['GameLoop'], game = measure(lambda: SimulationNoVisual.GameLoop('RL'), repeat)
+    results['Simulations'], played = measure(lambda: ParallelSimulation.run(
+        ["Random", "Greedy", "RL"], n_games, n, n_boulders, RL_Policies, processes=1, seed=0), repeat)
+    return results
+
+def run(grid, n_games=10000, repeat=3):
+    """Benchmarks every (n, n_boulders) of grid
+    Returns: baseline dictionary with machine details"""
+    results = {}
+    for n, n_boulders in grid:
+        print('Benchmarking n={} n_boulders={}'.format(n, n_boulders))
+        results['{}_{}'.format(n, n_boulders)] = bench_config(n, n_boulders, n_games, repeat)
+    return {'Created':datetime.datetime.now().isoformat(timespec='seconds'), 'Machine':platform.platform(),
+            'Python':platform.python_version(), 'Games':n_games, 'Results':results}
+
+def compare(baseline, current, tolerance=0.2):
+    """Lists the stages whose time or peak memory grew by more than tolerance
+    Parameters:
+        baseline, current: dictionaries returned by run
+        tolerance: allowed relative growth
+    Returns: list of regression descriptions
+    """
+    regressions = []
+    for config, stages in current['Results'].items():
+        for stage, now in stages.items():
+            before = baseline['Results'].get(config, {}).get(stage)
+            if before is None:
+                continue
+            for key in ['seconds', 'peak_mb']:
+                if now[key] > before[key]*(1+tolerance) and now[key]-before[key] > NOISE[key]:
+                    regressions.append('{} {} {}: {:.4g} -> {:.4g} ({:+.0%})'.format(
+                        config, stage, key, before[key], now[key], now[key]/before[key]-1))
+    return regressions
+
+def report(results):
+    """Prints a table of every measurement"""
+    print('{:<8}{:<38}{:>12}{:>12}'.format('config', 'stage', 'seconds', 'peak MB'))
+    for config, stages in results['Results'].items():
+        for stage, m in stages.items():
+            print('{:<8}{:<38}{:>12.4f}{:>12.2f}'.format(config, stage, m['seconds'], m['peak_mb']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark model build, solve and simulation')
+    parser.add_argument('--grid', nargs='+', default=['3x2', '4x2'], help='environments as NxBOULDERS')
+    parser.add_argument('--games', type=int, default=10000, help='games per policy in Simulations')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage')
+    parser.add_argument('--save', help='write results to this baseline file')
+    parser.add_argument('--compare', help='baseline file to check the results against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args()
+
+    grid = [tuple(int(v) for v in config.split('x')) for config in args.grid]
+    results = run(grid, args.games, args.repeat)
+    report(results)
+    if args.save:
+        if os.path.dirname(args.save):
+            os.makedirs(os.path.dirname(args.save), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for line in regressions:
+            print('REGRESSION', line)
+        if regressions:
+            raise SystemExit(1)
+        print('No regressions against', args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -1,129 +1,231 @@
-from scipy.sparse import csr_matrix, lil_matrix
+from scipy.sparse import csr_matrix
+from multiprocessing import Pool
 import numpy as np
+import time, tracemalloc
 import itertools
 import random
 import math
 
+# States are packed integers rather than strings. A row is a bitmask where
+# bit i is set when the row string has a '1' at position n-1-i, so
+# int(row, 2) converts a row string and a boulder state of n rows is the
+# concatenation of its row masks with the top row in the highest bits.
+# The alien is stored as the bit index of its row mask, so the alien
+# collides with the bottom row exactly when boulders & (1 << alien) != 0.
+
+def row_to_mask(row):
+    """Converts a row string such as '0100' into its bitmask"""
+    return int(row, 2)
+
+def mask_to_row(mask, n):
+    """Converts a row bitmask back into its string form"""
+    return format(int(mask), '0{}b'.format(n))
+
+def state_to_mask(state):
+    """Converts a boulder state string of n rows into its packed integer"""
+    return int(state, 2)
+
+def mask_to_state(mask, n):
+    """Converts a packed boulder state back into its string form"""
+    return format(int(mask), '0{}b'.format(n*n))
+
+def alien_to_string(alien, n):
+    """Converts an alien bit index into its row string. Ex. 0 -> '0001'"""
+    return mask_to_row(1 << int(alien), n)
+
+def full_state_to_string(alien, boulders, n):
+    """Converts an alien bit index and packed boulder state to the full state string"""
+    return alien_to_string(alien, n) + mask_to_state(boulders, n)
+
+def bottom_row(boulders, n):
+    """Returns the bitmask of the bottom row of a packed boulder state"""
+    return boulders & ((1 << n) - 1)
+
+def shift_down(boulders, new_row, n):
+    """Moves every boulder row down one and places new_row on top"""
+    return (boulders >> n) | (new_row << (n*(n-1)))
+
+def alien_movement_table(n):
+    """Returns an (n, 3) array of the alien position after each action RLU.
+    Moving right lowers the bit index and moving left raises it, clamped at the walls."""
+    alien=np.arange(n)
+    return np.stack([np.maximum(alien-1, 0), np.minimum(alien+1, n-1), alien], axis=1)
+
 def gen_positions(n, n_boulders):
     """Generates state codes for boulders. Includes empty rows
     Parameters:
         n: number of rows/columns
         n_boulders: number of boulders per row
     return value:
-        Possible boulder and alien states
+        Possible boulder row masks (empty row last) and alien positions
     """
-    boulder_positions=[]; b_p=[]
-
-    alien_positions_with_0=["{}1{}".format('0'*(n-i-1),'0'*(i)) for i in range(n)]+['0'*n]
+    alien_positions=list(range(n))
     if n_boulders==1:
-        return alien_positions_with_0, alien_positions_with_0[0:n]
+        positions=[1 << i for i in range(n)]
     else:
         positions=[]
-        position_index=list(itertools.combinations(range(n), n_boulders))
-        for tup in position_index:
-            pos=''
-            for i in range(n):
-                if i in tup:
-                    pos+='1'
-                else:
-                    pos+='0'
-            positions.append(pos)
-        if '0'*n not in boulder_positions:
-            positions.append('0'*n)
-        return positions, alien_positions_with_0[0:n]
+        for tup in itertools.combinations(range(n), n_boulders):
+            positions.append(sum(1 << (n-1-i) for i in tup))
+    positions.append(0)
+    return positions, alien_positions
+
+# Valid boulder states are n rows, top first, where the first m rows are non-empty
+# and the rest are empty. Writing row i as its index d_i in boulder_positions (the
+# empty row is last, index K), valid states sorted by their digits as itertools.product
+# would sort them are K blocks of count_states(n-1, K) states, one per top row,
+# followed by the all empty state. rank_states and unrank_states walk these blocks,
+# so state ids are computed arithmetically without enumerating product^n candidates.
+
+def count_states(n, K):
+    """Number of valid boulder states of n rows with K non-empty row options"""
+    return sum(K**j for j in range(n+1))
+
+def rank_states(states, n, boulder_positions, rows=None):
+    """Returns the dense index of each packed boulder state.
+    rows is the number of rows in each state, n when None"""
+    states = np.asarray(states, dtype=np.int64); K = len(boulder_positions)-1
+    rows = n if rows is None else rows
+    digit_of_mask = np.zeros(1 << n, dtype=np.int64)
+    digit_of_mask[np.asarray(boulder_positions)] = np.arange(K+1)
+    ranks = np.zeros(states.shape, dtype=np.int64); alive = np.ones(states.shape, dtype=bool)
+    for i in range(rows):
+        block = count_states(rows-i-1, K)
+        digit = digit_of_mask[(states >> (n*(rows-1-i))) & ((1 << n)-1)]
+        ranks += np.where(alive, digit*block, 0) # the empty digit K skips every non-empty block
+        alive &= digit < K
+    return ranks
+
+def unrank_states(ranks, n, boulder_positions):
+    """Returns the packed boulder state of each dense index"""
+    ranks = np.array(ranks, dtype=np.int64); K = len(boulder_positions)-1
+    positions = np.asarray(boulder_positions, dtype=np.int64)
+    states = np.zeros(ranks.shape, dtype=np.int64); alive = np.ones(ranks.shape, dtype=bool)
+    for i in range(n):
+        block = count_states(n-i-1, K)
+        alive &= ranks < K*block
+        digit = np.where(alive, ranks // block, K)
+        ranks = np.where(alive, ranks % block, ranks)
+        states = (states << n) | positions[digit]
+    return states
+
+def iter_state_positions(n, boulder_positions, chunk_size=1 << 20):
+    """Yields the packed boulder states in index order, chunk_size at a time"""
+    total = count_states(n, len(boulder_positions)-1)
+    for start in range(0, total, chunk_size):
+        yield unrank_states(np.arange(start, min(start+chunk_size, total)), n, boulder_positions)
 
 def gen_state_positions(n, n_boulders, boulder_positions):
     """Generates all possible states of boulders and alien
     Parameters:
         n: number of rows/columns
         n_boulders: number of boulders per row
-        boulder_positions: possible positions of boulders in row
-            ex. '10010' would be a boulder in the 1st and 4th column.
+        boulder_positions: possible row masks of boulders, empty row last
+            ex. 0b10010 would be a boulder in the 1st and 4th column.
+    Returns: array of packed boulder states. Empty rows may only sit below
+        non-empty rows, and states are ordered as itertools.product would order them.
     """
-    boulder_states=[]; b_p=[]
-    for item in itertools.product(boulder_positions, repeat=n):
-        boulder_states.append(''.join(item))
-    for b in boulder_states:
-        if b.count('1')<=n*n_boulders:
-            b_list=[int(str(int(b[i:i+n]))[0]) for i in range(0, len(b), n)]
-            keep=True; first_i=b_list[0]
-            for a in range(1,n):
-                if first_i==0 and b_list[a]==1:
-                    keep=False
-                first_i=b_list[a]
-            if keep:
-                b_p.append(b)
-        else:
-            b_p.append(b)
-    return b_p
+    return unrank_states(np.arange(count_states(n, len(boulder_positions)-1)), n, boulder_positions)
 
 
 def create_reference_dictionaries(state_space):
     """Creates reference dictionaries for future referall"""
-    state_to_index={}
-    index_to_state={}
-    for i in range(len(state_space)):
-        state_to_index[state_space[i]]=i
-        index_to_state[i]=state_space[i]
+    states=np.asarray(state_space).tolist()
+    state_to_index=dict(zip(states, range(len(states))))
+    index_to_state=dict(enumerate(states))
     return state_to_index, index_to_state
 
-def boulder_down(n, state_space, state_to_index, boulder_positions):
-    """Moves boulder down one position. Creates dictionary of all possible locations of the new boulders"""
-    b_down={}
-    for state in state_space:
-        b_list=[]
-        b_pos=state[:-n] # removes the bottom row
-
-        for opt in boulder_positions:
-            if opt!='0'*n:
-                new_state=opt+b_pos
-                b_list.append(state_to_index[new_state])
-        b_down[state_to_index[state]]=b_list
+def boulder_down(n, state_space, boulder_positions, chunk_size=1 << 18):
+    """Moves boulder down one position. Creates array of all possible locations of the new boulders.
+    Row k holds the indices of the states reachable from state k, one per non-empty new row.
+    States are shifted and ranked chunk_size at a time, so only the result is held in full."""
+    new_rows=np.array([opt for opt in boulder_positions if opt!=0], dtype=np.int64)
+    state_space=np.asarray(state_space)
+    b_down=np.empty((len(state_space), len(new_rows)), dtype=np.int64)
+    for start in range(0, len(state_space), chunk_size):
+        shifted=shift_down(state_space[start:start+chunk_size, None], new_rows[None, :], n)
+        b_down[start:start+chunk_size]=rank_states(shifted, n, boulder_positions)
     return b_down
 
+def boulder_down_shard(job):
+    """boulder_down for the boulder state indices start to stop
+    Parameters:
+        job: tuple of n, boulder_positions, start and stop
+    Returns: [stop-start, K] successor indices"""
+    n, boulder_positions, start, stop = job
+    return boulder_down(n, unrank_states(np.arange(start, stop), n, boulder_positions), boulder_positions)
+
+def boulder_down_sharded(n, boulder_positions, processes=None, shard_size=1 << 18):
+    """boulder_down computed in shards of state indices across a process pool. Each worker
+    unranks its own range of states, so only the successor indices are sent back.
+    Parameters:
+        n: number of rows/columns
+        boulder_positions: possible row masks of boulders, empty row last
+        processes: number of worker processes, all cores when None
+        shard_size: boulder states per shard
+    Returns: [nB, K] successor indices
+    """
+    nB=count_states(n, len(boulder_positions)-1)
+    jobs=[(n, boulder_positions, start, min(start+shard_size, nB)) for start in range(0, nB, shard_size)]
+    with Pool(processes) as pool:
+        return np.concatenate(pool.map(boulder_down_shard, jobs))
+
 def create_B(n, n_boulders, b_down, state_space, boulder_positions):
-    """Creates sparse matrix with movement probabilities from state space"""
-    #state_matrix=np.zeros([len(state_space),len(state_space)])
+    """Creates sparse matrix with movement probabilities from state space.
+    Row k has one entry per successor in b_down[k], so the CSR arrays are built directly."""
     print('Size:',(len(state_space), len(state_space)))
-    state_matrix=lil_matrix((len(state_space), len(state_space)))
-    prob=1/(len(boulder_positions)-1)
-    for k,v in b_down.items():
-        state_matrix[k,v]=prob
-    return csr_matrix(state_matrix)
+    b_down=np.asarray(b_down); nB, n_next=b_down.shape
+    state_matrix=csr_matrix((np.full(nB*n_next, 1/n_next), b_down.ravel(), np.arange(0, nB*n_next+1, n_next)), shape=(nB, nB))
+    state_matrix.sort_indices()
+    return state_matrix
 
 def endgame_states(n, alien_positions, state_space):
-    full_states=[]
-    for a_state in alien_positions:
-        for b_state in state_space:
-            full_states.append(a_state+b_state)
-    collisions=[]
-    for state in full_states:
-        for i in range(n):
-            p=False
-            if state[0:n][i]==state[-n:][i] and state[0:n][i]=='1':
-                p=True
-            if p:
-                collisions.append(state)
-    collisions=list(set(collisions))
-    state_reward={}
-    for state in full_states:
-        if state in collisions:
-            state_reward[state] = -5
-        else:
-            state_reward[state] = 1
-
+    """Finds collisions and rewards for every full state.
+    Full state index a*len(state_space)+b pairs alien_positions[a] with state_space[b].
+    Returns: boolean collision array, reward array and packed full states (alien << n*n | boulders)
+    """
+    state_space=np.asarray(state_space)
+    aliens=np.asarray(alien_positions, dtype=np.int64)
+    full_states=((aliens[:, None] << (n*n)) | state_space[None, :]).ravel()
+    collisions=((state_space[None, :] & (1 << aliens)[:, None])!=0).ravel()
+    state_reward=np.where(collisions, -5, 1)
     return collisions, state_reward, full_states
 
-def main(n, n_boulders):
-    """Takes n and n boulders and creates B matrix"""
-    if n>=5 and n_boulders>=2:
+def timed(phases, name, func, *args):
+    """Calls func, adding its time and traced peak memory to phases when phases is a list"""
+    if phases is None:
+        return func(*args)
+    tracemalloc.reset_peak(); start=time.perf_counter()
+    result=func(*args)
+    phases.append((name, time.perf_counter()-start, tracemalloc.get_traced_memory()[1]))
+    return result
+
+def main(n, n_boulders, processes=1, report=False):
+    """Takes n and n boulders and creates B matrix
+    Parameters:
+        n: number of rows/columns
+        n_boulders: number of boulders per row
+        processes: worker processes for boulder_down, sharded by state index. 1 builds in process
+        report: print the time and peak memory of every phase. Memory is traced in this
+            process only, so sharded work shows just the merged result
+    """
+    if count_states(n, len(gen_positions(n, n_boulders)[0])-1) > 10**7:
         print('Warning: Large environment. Expect delays')
-    boulder_positions, alien_positions=gen_positions(n,n_boulders)
-    state_space=gen_state_positions(n,n_boulders,boulder_positions)
-    state_to_index, index_to_state=create_reference_dictionaries(state_space)
-    b_down=boulder_down(n, state_space, state_to_index, boulder_positions)
-    collisions, state_reward, full_states=endgame_states(n, alien_positions, state_space)
-    if n>=5 and n_boulders>=2:
-        print('Creating boulder matrix...')
-    B=create_B(n, n_boulders, b_down, state_space, boulder_positions)
-    return B, b_down, state_to_index, index_to_state, state_space, boulder_positions, alien_positions, collisions, state_reward, full_states
+    phases=[] if report else None
+    tracing=report and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    boulder_positions, alien_positions=timed(phases, 'gen_positions', gen_positions, n, n_boulders)
+    state_space=timed(phases, 'gen_state_positions', gen_state_positions, n, n_boulders, boulder_positions)
+    if processes == 1:
+        b_down=timed(phases, 'boulder_down', boulder_down, n, state_space, boulder_positions)
+    else:
+        b_down=timed(phases, 'boulder_down', boulder_down_sharded, n, boulder_positions, processes)
+    collisions, state_reward, full_states=timed(phases, 'endgame_states', endgame_states, n, alien_positions, state_space)
+    B=timed(phases, 'create_B', create_B, n, n_boulders, b_down, state_space, boulder_positions)
+    if tracing:
+        tracemalloc.stop()
+    if report:
+        print('{:<32}{:>10}{:>12}'.format('phase', 'seconds', 'peak MB'))
+        for name, seconds, peak in phases:
+            print('{:<32}{:>10.3f}{:>12.1f}'.format(name, seconds, peak/2**20))
+    return B, b_down, state_space, boulder_positions, alien_positions, collisions, state_reward, full_states
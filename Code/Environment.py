@@ -0,0 +1,155 @@
+import BoulderMatrix, ModelCache, numpy as np
+import random
+
+# Single game environment for training code and the simulation scripts. Every table
+# is built once per environment, so reset and step are a handful of integer lookups.
+# Observations are full state indices alien*nB+boulders, the indices used by
+# PolicyIteration and CompiledPolicy, and actions are 0 right, 1 left, 2 up/none.
+# BatchEnvironment steps many games at once with arrays and needs no tables at all.
+
+class AlienMeteoriteEnv(object):
+    """Alien-meteorite game with constant time reset and step.
+    Attributes:
+        reset: starts a new game and returns its first state
+        step: plays one action and returns state, reward, done and info
+        play: plays one game with a CompiledPolicy
+        position: screen column of the alien
+        boulder_state: packed boulder state
+    """
+    n_actions = 3
+
+    def __init__(self, n=4, n_boulders=2, seed=None, model=None):
+        """Loads the transition and collision tables
+        Parameters:
+            n: number of rows/columns
+            n_boulders: number of boulders/meteorites per row
+            seed: seed of the random top rows and start positions
+            model: ModelCache.Model to use, loaded from the cache when None
+        """
+        model = ModelCache.load(n, n_boulders) if model is None else model
+        self.n = n; self.n_boulders = n_boulders
+        self.b_down = np.array(model.b_down, dtype=np.int64) # copied out of the memory map
+        self.nB, self.n_next = self.b_down.shape
+        self.collisions = np.array(model.collisions, dtype=bool)
+        self.rewards = np.array(model.state_reward, dtype=np.int64)
+        self.state_space = model.state_space
+        self.moves = BoulderMatrix.alien_movement_table(n).tolist() # [alien][action] next alien
+        self.n_states = n*self.nB
+        self.rng = random.Random(seed)
+        self.alien = self.boulders = self.state = None
+        self.score = 0; self.turns = 0; self.done = True
+
+    def seed(self, seed=None):
+        """Reseeds the random top rows and start positions"""
+        self.rng.seed(seed)
+
+    def reset(self, seed=None):
+        """Starts a game with a random alien position and no boulders
+        Returns: full state index"""
+        if seed is not None:
+            self.rng.seed(seed)
+        self.alien = self.rng.randrange(self.n); self.boulders = self.nB-1 # empty state is last
+        self.state = self.alien*self.nB+self.boulders
+        self.score = 0; self.turns = 0; self.done = False
+        return self.state
+
+    def step(self, action):
+        """Moves the alien, drops the boulders one row and adds a random top row
+        Parameters:
+            action: 0 right, 1 left, 2 up/none
+        Returns: full state index, reward, whether the alien was hit, and an info dictionary
+        """
+        if self.done:
+            raise RuntimeError('step called on a finished game, call reset first')
+        self.alien = self.moves[self.alien][action]
+        self.boulders = self.b_down.item(self.boulders, self.rng.randrange(self.n_next))
+        state = self.state = self.alien*self.nB+self.boulders
+        self.done = self.collisions.item(state)
+        self.turns += 1; self.score += not self.done
+        return state, self.rewards.item(state), self.done, {'score':self.score}
+
+    def play(self, policy, record_states=False):
+        """Plays one game
+        Parameters:
+            policy: CompiledPolicy indexed by full state index
+            record_states: also return every visited full state index
+        Returns: score and the visited states, or the death state
+        """
+        state = self.reset(); visited = []
+        while not self.done:
+            state = self.step(policy.act(state))[0]
+            if record_states:
+                visited.append(state)
+        return self.score, visited if record_states else state
+
+    @property
+    def position(self):
+        return self.n-1-self.alien
+
+    @property
+    def boulder_state(self):
+        return int(self.state_space[self.boulders])
+
+    def state_string(self):
+        """Full state of the current turn as a string"""
+        return BoulderMatrix.full_state_to_string(self.alien, self.boulder_state, self.n)
+
+class BatchEnvironment(object):
+    """n_envs games stepped together with arrays, for training code. Boulders are kept as
+    packed states and advanced with BoulderMatrix.shift_down, so no transition table is
+    built, and BoulderMatrix.rank_states turns them into the same state indices as
+    AlienMeteoriteEnv. Rewards follow BoulderMatrix.endgame_states.
+    Attributes:
+        reset: starts every game
+        step: plays one action in every game
+        restart: starts the games that just ended
+        keep: drops games from the batch
+    """
+    n_actions = 3
+
+    def __init__(self, n, n_boulders, n_envs, seed=None):
+        """Creates the batch
+        Parameters:
+            n: number of rows/columns
+            n_boulders: number of boulders/meteorites per row
+            n_envs: number of games
+            seed: seed of the random top rows and start positions
+        """
+        self.n = n; self.n_boulders = n_boulders; self.n_envs = n_envs
+        self.boulder_positions = np.array(BoulderMatrix.gen_positions(n, n_boulders)[0], dtype=np.int64)
+        self.new_rows = self.boulder_positions[:-1] # the empty row is last
+        self.nB = BoulderMatrix.count_states(n, len(self.new_rows)); self.n_states = n*self.nB
+        self.moves = BoulderMatrix.alien_movement_table(n)
+        self.rng = np.random.default_rng(seed)
+        self.alien = np.zeros(n_envs, dtype=np.int64); self.boulders = np.zeros(n_envs, dtype=np.int64)
+
+    def states(self):
+        """Full state index of every game"""
+        return self.alien*self.nB + BoulderMatrix.rank_states(self.boulders, self.n, self.boulder_positions)
+
+    def reset(self):
+        """Starts every game with a random alien position and no boulders
+        Returns: full state indices"""
+        self.alien = self.rng.integers(0, self.n, size=self.n_envs); self.boulders = np.zeros(self.n_envs, dtype=np.int64)
+        return self.states()
+
+    def step(self, actions):
+        """Moves every alien, drops the boulders one row and adds random top rows
+        Parameters:
+            actions: action of every game, 0 right, 1 left, 2 up/none
+        Returns: full state indices, rewards, and which aliens were hit
+        """
+        self.alien = self.moves[self.alien, actions]
+        self.boulders = BoulderMatrix.shift_down(self.boulders, self.new_rows[self.rng.integers(0, len(self.new_rows), size=self.n_envs)], self.n)
+        hit = (self.boulders >> self.alien) & 1 == 1 # the bottom row is in the low bits
+        return self.states(), np.where(hit, -5, 1), hit
+
+    def restart(self, done):
+        """Starts new games in place of the finished ones
+        Returns: full state indices"""
+        self.alien[done] = self.rng.integers(0, self.n, size=int(done.sum())); self.boulders[done] = 0
+        return self.states()
+
+    def keep(self, alive):
+        """Drops the games where alive is False"""
+        self.alien = self.alien[alive]; self.boulders = self.boulders[alive]; self.n_envs = len(self.alien)
@@ -0,0 +1,160 @@
+from policies import Policies, CompiledPolicy, N_ALLOWED
+from scipy.sparse import csr_matrix, identity
+from scipy.sparse.linalg import bicgstab
+import BoulderMatrix, ModelCache, PolicyArtifact, numpy as np
+import argparse
+
+# Exact scores of a stationary policy without simulating. Under a fixed policy the game
+# is an absorbing Markov chain: collision states absorb, every other full state is
+# transient, and the score is the number of transient states visited after the start.
+# With Q the transient to transient transition matrix, the expected score E from every
+# state solves (I-Q) E = Q 1 and its second moment M solves (I-Q) M = Q (1 + 2E). LU
+# factors of I-Q fill in badly past 4x2, but boulders fall off the board within n
+# turns, so BiCGSTAB converges to machine precision in a few dozen products with Q.
+# The score distribution comes from pushing the start distribution through Q one turn
+# at a time.
+RTOL = 1e-12 # relative residual of the linear solves
+
+def action_probabilities(policy):
+    """Probability of each action in every full state, the set bits of a CompiledPolicy
+    being equally likely
+    Returns: [nS, 3] array"""
+    bits = (policy.masks[:, None] >> np.arange(3)) & 1
+    return bits / N_ALLOWED[policy.masks][:, None]
+
+def transient_matrix(policy, n, b_down, collisions):
+    """Transition matrix of the game under policy, restricted to moves between states the
+    alien survives. Rows of collision states are empty, so they absorb.
+    Parameters:
+        policy: CompiledPolicy indexed by full state index
+        n: number of rows/columns
+        b_down: [nB, K] next boulder state indices for each boulder state index
+        collisions: boolean array over full state indices
+    Returns: [nS, nS] csr_matrix Q
+    """
+    b_down = np.asarray(b_down); collisions = np.asarray(collisions, dtype=bool)
+    nB, n_next = b_down.shape; nS = n*nB
+    alien, boulders = np.divmod(np.arange(nS), nB)
+    moves = BoulderMatrix.alien_movement_table(n); probs = action_probabilities(policy)
+    rows = []; cols = []; data = []
+    for action in range(3):
+        to_alien = moves[alien, action]*nB
+        for j in range(n_next):
+            rows.append(np.arange(nS)); cols.append(to_alien + b_down[boulders, j]); data.append(probs[:, action]/n_next)
+    rows = np.concatenate(rows); cols = np.concatenate(cols); data = np.concatenate(data)
+    keep = (data > 0) & ~collisions[rows] & ~collisions[cols]
+    return csr_matrix((data[keep], (rows[keep], cols[keep])), shape=(nS, nS)) # duplicate moves are summed
+
+def start_states(n, nB):
+    """Full state index of every start: any alien position and no boulders"""
+    return np.arange(n)*nB + nB-1
+
+def reachable(Q, targets):
+    """States with a path of transitions in Q to any of targets, targets included"""
+    found = np.asarray(targets, dtype=bool)
+    while True:
+        grown = found | (Q @ found.astype(float) > 0)
+        if (grown == found).all():
+            return found
+        found = grown
+
+def unbounded_states(Q):
+    """States whose expected score is infinite: those that can reach a set of states the
+    policy never leaves for a collision, ex. any state of 4x1 under Greedy"""
+    survive = np.asarray(Q.sum(axis=1)).ravel()
+    can_die = reachable(Q, ~np.isclose(survive, 1.0, rtol=0, atol=1e-9))
+    return reachable(Q, ~can_die)
+
+def solve(A, b):
+    """Solves A x = b with BiCGSTAB to RTOL"""
+    x, info = bicgstab(A, b, rtol=RTOL, atol=0.0, maxiter=10*A.shape[0])
+    if info != 0:
+        raise RuntimeError('BiCGSTAB did not converge, info {}'.format(info))
+    return x
+
+def expected_scores(Q):
+    """Mean and second moment of the score from every full state
+    Parameters:
+        Q: transient_matrix of the policy
+    Returns: arrays E and M. Both are inf from states where the policy can survive forever
+    """
+    nS = Q.shape[0]
+    E = np.full(nS, np.inf); M = np.full(nS, np.inf)
+    finite = ~unbounded_states(Q)
+    if not finite.any():
+        return E, M
+    Qf = Q[finite][:, finite] if not finite.all() else Q # finite states never move to unbounded ones
+    A = identity(Qf.shape[0], format='csr') - Qf
+    survive = np.asarray(Qf.sum(axis=1)).ravel()
+    E[finite] = solve(A, survive)
+    M[finite] = solve(A, survive + 2*(Qf @ E[finite]))
+    return E, M
+
+def score_distribution(Q, starts, horizon=1000):
+    """Probability of every score below horizon for games begun uniformly over starts
+    Parameters:
+        Q: transient_matrix of the policy
+        starts: full state indices a game starts from
+        horizon: number of scores to compute
+    Returns: array of P(score = t) for t < horizon, and P(score >= horizon)
+    """
+    alive = np.zeros(Q.shape[0]); alive[starts] = 1/len(starts)
+    QT = Q.T.tocsr(); survival = np.empty(horizon+1); survival[0] = 1.0
+    for t in range(1, horizon+1):
+        alive = QT @ alive # probability of being alive in each state after t turns
+        survival[t] = alive.sum()
+    return survival[:-1]-survival[1:], survival[-1]
+
+def score(policy, n, b_down, collisions, horizon=None):
+    """Exact score statistics of a policy from the start of a game
+    Parameters:
+        policy: CompiledPolicy indexed by full state index
+        n: number of rows/columns
+        b_down: [nB, K] next boulder state indices for each boulder state index
+        collisions: boolean array over full state indices
+        horizon: also compute the score distribution up to horizon
+    Returns: dictionary of the mean and standard deviation of the score, and the
+        distribution with its tail probability when horizon is given
+    """
+    Q = transient_matrix(policy, n, b_down, collisions)
+    E, M = expected_scores(Q)
+    starts = start_states(n, len(b_down))
+    mean = float(E[starts].mean()); second = float(M[starts].mean())
+    result = {'Mean':mean, 'Std':float(np.sqrt(max(second-mean**2, 0.0))) if np.isfinite(second) else np.inf}
+    if horizon:
+        result['Distribution'], result['Tail'] = score_distribution(Q, starts, horizon)
+    return result
+
+def main(n, n_boulders, policies=("Random", "Greedy", "RL"), horizon=None, rl_path=None):
+    """Prints the exact score of each policy
+    Parameters:
+        n: number of rows/columns
+        n_boulders: number of boulders/meteorites per row
+        policies: list of Random, Greedy, GreedyK, or RL
+        horizon: also compute the score distributions up to horizon
+        rl_path: policy artifact of RL, PolicyArtifact.artifact_path when None
+    Returns: dictionary of policy to score statistics
+    """
+    model = ModelCache.load(n, n_boulders); results = {}
+    for name in policies:
+        if name == "RL":
+            policy = CompiledPolicy.load(rl_path or PolicyArtifact.artifact_path(n, n_boulders))
+        else:
+            policy = Policies.compile(name, model.movement_rewards, None, n, model.full_states)
+        results[name] = score(policy, n, model.b_down, model.collisions, horizon)
+        line = '{} scores {:.4f} on average, standard deviation {:.4f}'.format(name, results[name]['Mean'], results[name]['Std'])
+        if horizon:
+            median = int(np.searchsorted(np.cumsum(results[name]['Distribution']), 0.5))
+            line += ', median {}, P(score >= {}) = {:.3g}'.format(median if median < horizon else '>= {}'.format(horizon),
+                                                              horizon, results[name]['Tail'])
+        print(line)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exact expected score of policies from an absorbing Markov chain')
+    parser.add_argument('n', type=int); parser.add_argument('n_boulders', type=int)
+    parser.add_argument('--policies', nargs='+', default=["Random", "Greedy", "RL"])
+    parser.add_argument('--horizon', type=int, help='also compute score distributions up to this score')
+    parser.add_argument('--rl', help='policy artifact of the RL policy')
+    args = parser.parse_args()
+    main(args.n, args.n_boulders, args.policies, args.horizon, args.rl)
@@ -0,0 +1,70 @@
+import time
+
+# Per-phase timing for the game loops. A loop calls start() once, then lap(phase)
+# after each phase, which charges the time since the previous lap to that phase.
+# Loops that are not being profiled use DISABLED, whose methods do nothing, so the
+# only cost left in the hot path is a few empty method calls per turn.
+
+class PhaseTimer(object):
+    """Accumulated seconds and calls per phase, plus event counters.
+    Attributes:
+        start: resets the lap clock
+        lap: charges the time since the last lap to a phase
+        count: adds to an event counter
+        summary: dictionary of phase timings and rates
+        report: prints the summary as a table
+    """
+    def __init__(self):
+        self.seconds = {}; self.calls = {}; self.counters = {}
+        self.last = time.perf_counter()
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + now - self.last
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self.last = now
+
+    def count(self, counter, k=1):
+        self.counters[counter] = self.counters.get(counter, 0) + k
+
+    def summary(self):
+        """Per phase seconds, share of the total, calls and calls per second, and the
+        counters with their rates per second and per game"""
+        total = sum(self.seconds.values())
+        phases = {phase:{'Seconds':seconds, 'Share':seconds/total if total else 0.0, 'Calls':self.calls[phase],
+                         'Per second':self.calls[phase]/seconds if seconds else 0.0}
+                  for phase, seconds in self.seconds.items()}
+        rates = {}
+        for counter, k in self.counters.items():
+            rates['{} per second'.format(counter)] = k/total if total else 0.0
+            if counter != 'games' and self.counters.get('games'):
+                rates['{} per game'.format(counter)] = k/self.counters['games']
+        return {'Seconds':total, 'Phases':phases, 'Counters':dict(self.counters), 'Rates':rates}
+
+    def report(self, title='Profile'):
+        """Prints the summary, slowest phase first"""
+        summary = self.summary()
+        print('{} ({:.3f}s)'.format(title, summary['Seconds']))
+        print('{:<20}{:>12}{:>8}{:>12}{:>14}'.format('phase', 'seconds', 'share', 'calls', 'per second'))
+        for phase, p in sorted(summary['Phases'].items(), key=lambda item: -item[1]['Seconds']):
+            print('{:<20}{:>12.4f}{:>8.1%}{:>12}{:>14.0f}'.format(phase, p['Seconds'], p['Share'], p['Calls'], p['Per second']))
+        for rate, value in summary['Rates'].items():
+            print('{:<32}{:>14.2f}'.format(rate, value))
+        return summary
+
+class NullTimer(object):
+    """PhaseTimer stand in that records nothing"""
+
+    def start(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def count(self, counter, k=1):
+        pass
+
+DISABLED = NullTimer()
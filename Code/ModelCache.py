@@ -0,0 +1,79 @@
+import BoulderMatrix, MovementRewards, numpy as np
+from scipy.sparse import csr_matrix
+import hashlib, os, shutil, tempfile
+
+# Environment models are cached on disk, one directory of .npy arrays per
+# (n, n_boulders, code version). The code version hashes the source of the modules
+# that build the model, so editing them invalidates old entries automatically.
+CACHE_DIR = os.environ.get('ALIEN_MODEL_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'PygameAlienRL'))
+ARRAYS = ['state_space', 'b_down', 'boulder_positions', 'alien_positions', 'collisions', 'state_reward',
+          'full_states', 'movement_rewards', 'B_data', 'B_indices', 'B_indptr']
+
+def code_version():
+    """Hash of the source files the model is built from"""
+    sha = hashlib.sha1()
+    for module in [BoulderMatrix, MovementRewards]:
+        with open(module.__file__, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()[:16]
+
+def cache_path(n, n_boulders, cache_dir=None):
+    """Directory holding the cached model for n, n_boulders and the current code"""
+    key = hashlib.sha1('{}-{}-{}'.format(n, n_boulders, code_version()).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir or CACHE_DIR, 'n{}_b{}_{}'.format(n, n_boulders, key))
+
+def build(n, n_boulders):
+    """Builds every model array with BoulderMatrix.main and MovementRewards.main"""
+    B, b_down, state_space, boulder_positions, alien_positions, collisions, state_reward, full_states = BoulderMatrix.main(n, n_boulders)
+    return {'state_space':state_space, 'b_down':b_down, 'boulder_positions':np.array(boulder_positions),
+            'alien_positions':np.array(alien_positions), 'collisions':collisions, 'state_reward':state_reward,
+            'full_states':full_states, 'movement_rewards':MovementRewards.main(n, full_states),
+            'B_data':B.data, 'B_indices':B.indices, 'B_indptr':B.indptr}
+
+def save(path, arrays):
+    """Writes arrays to a temporary directory and renames it into place, so readers
+    never see a half written entry"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(path))
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, name+'.npy'), np.asarray(array))
+    try:
+        os.rename(tmp, path)
+    except OSError: # another process cached the same model first
+        shutil.rmtree(tmp)
+
+class Model(object):
+    """Cached environment model. Arrays are memory mapped on first access.
+    Attributes:
+        n, n_boulders: environment size
+        state_space, b_down, boulder_positions, alien_positions, collisions,
+        state_reward, full_states, movement_rewards: arrays as built by BoulderMatrix and MovementRewards
+        B: boulder transition matrix
+    """
+    def __init__(self, path, n, n_boulders):
+        self.path = path; self.n = n; self.n_boulders = n_boulders
+
+    def __getattr__(self, name):
+        if name not in ARRAYS:
+            raise AttributeError(name)
+        array = np.load(os.path.join(self.path, name+'.npy'), mmap_mode='r')
+        setattr(self, name, array)
+        return array
+
+    @property
+    def B(self):
+        nB = len(self.state_space)
+        return csr_matrix((self.B_data, self.B_indices, self.B_indptr), shape=(nB, nB))
+
+def load(n, n_boulders, cache_dir=None):
+    """Returns the cached model for n, n_boulders, building and caching it on first use
+    Parameters:
+        n: number of rows/columns
+        n_boulders: number of boulders/meteorites per row
+        cache_dir: cache location, CACHE_DIR when None
+    Returns: Model
+    """
+    path = cache_path(n, n_boulders, cache_dir)
+    if not os.path.isdir(path):
+        save(path, build(n, n_boulders))
+    return Model(path, n, n_boulders)
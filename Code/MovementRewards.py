@@ -1,70 +1,62 @@
+import BoulderMatrix, numpy as np
 import math
 
 def collision(state, n):
-    """returns true if boulder collides with alien"""
-    for i in range(n):
-        p=False
-        if state[0:n][i]==state[-n:][i] and state[0:n][i]=='1':
-            return True
-    return False
+    """returns true if boulder collides with alien. state is a packed full state"""
+    alien=state >> (n*n)
+    return (state & (1 << alien) & ((1 << n)-1))!=0
 
-def bottom_row_rewards(full_states, n):
-    """returns the reward for only the bottom row
+def bottom_row_rewards(n):
+    """returns the reward for only the bottom row as an (alien, row mask) table
     1 for not collision, -inf for collisison"""
-    next_row_only = list(set([a[:n]+a[-n-n:-n] for a in full_states]))
-    collisions=[]
-    for state in next_row_only:
-        if collision(state, n):
-            collisions.append(state)
+    alien=np.arange(n)[:, None]; rows=np.arange(1 << n)[None, :]
+    collisions=(rows & (1 << alien))!=0
+    state_reward=np.where(collisions, -1000, 1)
+    return collisions, state_reward
 
-    state_reward={}
-    for state in next_row_only:
-        if state in collisions:
-            state_reward[state] = -1000
-        else:
-            state_reward[state] = 1
-    return next_row_only, collisions, state_reward
-
-def bottom_row_movement(next_row_only, n):
-    """Defines movement logic and returns results of 3 actions RLU"""
-    movement_states={}
-    for state in next_row_only:
-        empty_R=['0']*n; empty_L=['0']*n
-        a_index=list(state[:n]).index('1')
-        if a_index==0:
-            empty_R[1]='1'; right=''.join(empty_R)
-            left=state[:n]
-        elif a_index==n-1:
-            right=state[:n]
-            empty_L[a_index-1]='1'; left = ''.join(empty_L)
-        else:
-            empty_R[a_index+1]='1'; right=''.join(empty_R)
-            empty_L[a_index-1]='1'; left=''.join(empty_L)
-        movement_states[state] = [right+state[n:], left+state[n:], state] #RLU
-    return movement_states
+def bottom_row_movement(n):
+    """Defines movement logic and returns results of 3 actions RLU for every alien position"""
+    return BoulderMatrix.alien_movement_table(n)
 
 def bottom_row_movement_rewards(movement_states, state_reward, n):
-    """Assigns rewards for each action RLU"""
-    movement_rewards_partial={}
-    for k,v_list in movement_states.items():
-        m_reward=[]
-        for v in v_list:
-            m_reward.append(state_reward[v])
-        movement_rewards_partial[k]=m_reward
-    return movement_rewards_partial
+    """Assigns rewards for each action RLU. Returns an (alien, row mask, action) table"""
+    return state_reward[movement_states, :].transpose(0, 2, 1)
 
 def gen_full_movement_rewards(full_states, movement_rewards_partial, n):
-    """Expands to all states"""
-    movement_rewards_full={}
-    for state in full_states:
-        partial_state=state[:n]+state[-n-n:-n]
-        movement_rewards_full[state]=movement_rewards_partial[partial_state]
-    return movement_rewards_full
+    """Expands to all states. Returns an (nS, 3) array indexed by full state index"""
+    full_states=np.asarray(full_states)
+    alien=full_states >> (n*n)
+    next_row=(full_states >> n) & ((1 << n)-1) # row the alien moves into
+    return movement_rewards_partial[alien, next_row]
+
+def lookahead_rewards(n, full_states, k=1):
+    """Turns survived over the next k rows after each action RLU, taking the best later
+    actions. Only rows already on screen are used, so k ranges from 1 to n-1, and k=1
+    marks the same safe moves as main. The table only depends on the alien and the next
+    k rows, so it is solved once per distinct window of rows and then expanded.
+    Parameters:
+        n: number of rows/columns
+        full_states: packed full states
+        k: rows of lookahead
+    Returns: (nS, 3) int8 array indexed by full state index
+    """
+    if not 1 <= k <= n-1:
+        raise ValueError('k must be between 1 and {} for n={}, got {}'.format(n-1, n, k))
+    full_states=np.asarray(full_states)
+    alien=full_states >> (n*n)
+    windows, inverse=np.unique((full_states >> n) & ((1 << (n*k))-1), return_inverse=True) # next k rows
+    collisions=bottom_row_rewards(n)[0]; moves=bottom_row_movement(n)
+    survived=np.zeros((len(windows), n), dtype=np.int8) # best turns after the current row, per alien position
+    for j in range(k-1, -1, -1): # row j of the window drops onto the alien on turn j+1
+        row=(windows >> (n*j)) & ((1 << n)-1)
+        turns=np.where(collisions[moves[None, :, :], row[:, None, None]], 0, 1+survived[:, moves]).astype(np.int8)
+        survived=turns.max(axis=2)
+    return turns[inverse.ravel(), alien]
 
 
 def main(n, full_states):
-    next_row_only, collisions, state_reward=bottom_row_rewards(full_states, n)
-    movement_states = bottom_row_movement(next_row_only, n)
+    collisions, state_reward=bottom_row_rewards(n)
+    movement_states = bottom_row_movement(n)
     movement_rewards_partial= bottom_row_movement_rewards(movement_states, state_reward, n)
     movement_rewards=gen_full_movement_rewards(full_states, movement_rewards_partial, n)
     return movement_rewards
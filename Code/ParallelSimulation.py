@@ -0,0 +1,164 @@
+import BatchSimulation, ModelCache, TrajectoryLog, numpy as np
+from policies import Policies
+from multiprocessing import Pool
+from progress.bar import Bar
+from scipy.stats import norm
+import math, os
+
+environment = {} # tables of the current process, filled in by init_worker
+
+def init_worker(n, n_boulders, RL_Policies, policies=("Random", "Greedy", "RL")):
+    """Loads the environment tables once per worker process
+    Parameters:
+        n: number of rows/columns
+        n_boulders: number of boulders/meteorites per row
+        RL_Policies: array of policy iteration actions indexed by full state index
+        policies: names of the policies to compile, see Policies.compile
+    """
+    model = ModelCache.load(n, n_boulders)
+    policies = {policy:Policies.compile(policy, model.movement_rewards, RL_Policies, n, model.full_states) for policy in policies}
+    environment.update({'n':n, 'n_boulders':n_boulders, 'b_down':model.b_down, 'collisions':model.collisions,
+                        'policies':policies})
+
+def play_shard(job):
+    """Plays one shard of games with its own seed.
+    Parameters:
+        job: tuple of shard index, policy, number of games, SeedSequence, record_states and max_turns
+    Returns: shard index, scores and deaths or visited states
+    """
+    shard, policy, n_games, seed, record_states, max_turns = job
+    env = environment
+    scores, states = BatchSimulation.play(env['policies'][policy], n_games, env['n'], env['b_down'], env['collisions'],
+                                          rng=np.random.default_rng(seed), record_states=record_states, max_turns=max_turns)
+    return shard, scores, states
+
+def shard_jobs(policies, n_games, shard_size, seed, record_states, max_turns):
+    """Splits n_games of each policy into shards. Shard i of a policy always gets the
+    same child of seed, so results do not depend on the number of processes."""
+    n_shards = math.ceil(n_games/shard_size); jobs = []
+    seeds = np.random.SeedSequence(seed).spawn(n_shards*len(policies))
+    for p, policy in enumerate(policies):
+        for i in range(n_shards):
+            jobs.append(((policy, i), policy, min(shard_size, n_games-i*shard_size), seeds[p*n_shards+i], record_states, max_turns))
+    return jobs
+
+def run(policies, n_games, n, n_boulders, RL_Policies, processes=None, shard_size=2500, seed=None, record_states=False, writer=None,
+        max_turns=10000):
+    """Plays n_games of each policy across one process pool.
+    Parameters:
+        policies: list of Random, Greedy, GreedyK, or RL
+        n_games: number of games per policy
+        n: number of rows/columns
+        n_boulders: number of boulders/meteorites per row
+        RL_Policies: array of policy iteration actions indexed by full state index
+        processes: number of worker processes, all cores when None, in process when 1
+        shard_size: games per shard
+        seed: entropy for the per shard SeedSequence, fresh entropy when None
+        record_states: also return the visited state indices of every game
+        writer: optional TrajectoryWriter. Games are appended to it as shards finish and
+            only scores and deaths are kept in memory
+        max_turns: turn cap of every game, see BatchSimulation.play. Games that reach it
+            score max_turns with death state -1, None plays until every game dies
+    Returns: dictionary of policy to array of scores and deaths or visited states, in shard order
+    """
+    keep_states = record_states and writer is None
+    jobs = shard_jobs(policies, n_games, shard_size, seed, record_states, max_turns)
+    bar = Bar('Simulating', max=n_games*len(policies), suffix='%(index)d/%(max)d - %(percent).1f%% - %(eta)ds')
+    shards = {}
+    if processes == 1:
+        init_worker(n, n_boulders, RL_Policies, policies)
+        finished = map(play_shard, jobs)
+        pool = None
+    else:
+        pool = Pool(processes, initializer=init_worker, initargs=(n, n_boulders, RL_Policies, policies))
+        finished = pool.imap_unordered(play_shard, jobs)
+    for shard, scores, states in finished:
+        shards[shard] = keep_shard(writer, shard, shard_size, scores, states, record_states)
+        bar.next(len(scores))
+    bar.finish()
+    if pool is not None:
+        pool.close(); pool.join()
+    return merge_shards(policies, jobs, shards, keep_states)
+
+def keep_shard(writer, shard, shard_size, scores, states, record_states):
+    """Appends a finished shard to writer, keeping only its death states in memory
+    Returns: scores and deaths or visited states"""
+    if writer is not None:
+        policy, i = shard
+        writer.write(policy, i*shard_size+np.arange(len(scores)), scores, states if record_states else None,
+                     None if record_states else states)
+        if record_states:
+            states = np.array([game[-1] for game in states], dtype=np.int64) # death states
+    return scores, states
+
+def merge_shards(policies, jobs, shards, keep_states):
+    """Concatenates the played shards of each policy in shard order"""
+    results = {}
+    for policy in policies:
+        merged = [shards[job[0]] for job in jobs if job[1]==policy and job[0] in shards] # jobs are in shard order
+        scores = np.concatenate([s for s, d in merged])
+        if keep_states:
+            results[policy] = (scores, [game for s, d in merged for game in d])
+        else:
+            results[policy] = (scores, np.concatenate([d for s, d in merged]))
+    return results
+
+def half_width(stats, confidence=0.95):
+    """Half width of the normal confidence interval on the mean of a RunningStats"""
+    if stats.count < 2:
+        return math.inf
+    return norm.ppf(0.5+confidence/2)*math.sqrt(stats.variance()/stats.count)
+
+def run_adaptive(policies, width, max_games, n, n_boulders, RL_Policies, confidence=0.95, min_games=1000, processes=None,
+                 shard_size=500, seed=None, record_states=False, writer=None, max_turns=10000):
+    """Plays each policy until the confidence interval on its mean score is narrower than width.
+    Shards are handed out in rounds of one per process for every policy still running, and
+    are accepted in shard order, checking the interval after each one. A policy stops at
+    the first shard that brings it under width, so the games kept do not depend on the
+    number of processes; shards of the same round past that point are dropped.
+    Parameters:
+        policies: list of Random, Greedy, GreedyK, or RL
+        width: target width of the confidence interval, in score units
+        max_games: games per policy when the interval is never narrow enough
+        n: number of rows/columns
+        n_boulders: number of boulders/meteorites per row
+        RL_Policies: array of policy iteration actions indexed by full state index
+        confidence: confidence level of the interval
+        min_games: games before the interval is first checked, so early variance estimates
+            from a few short games cannot stop a policy
+        processes: number of worker processes, all cores when None, in process when 1
+        shard_size: games per shard, the granularity of stopping
+        seed, record_states, writer, max_turns: as in run
+    Returns: results as in run, and per policy the score statistics with the interval
+        half width and whether it converged before max_games
+    """
+    keep_states = record_states and writer is None
+    jobs = shard_jobs(policies, max_games, shard_size, seed, record_states, max_turns)
+    pending = {policy:[job for job in jobs if job[1]==policy] for policy in policies} # in shard order
+    stats = {policy:TrajectoryLog.RunningStats() for policy in policies}
+    converged = {}; shards = {}
+    if processes == 1:
+        init_worker(n, n_boulders, RL_Policies, policies)
+        pool = None; per_round = 1
+    else:
+        pool = Pool(processes, initializer=init_worker, initargs=(n, n_boulders, RL_Policies, policies))
+        per_round = processes or os.cpu_count()
+    bar = Bar('Simulating', max=max_games*len(policies), suffix='%(index)d/%(max)d - %(percent).1f%% - %(eta)ds')
+    while any(pending.values()):
+        batch = [job for policy in policies for job in pending[policy][:per_round]]
+        finished = pool.map(play_shard, batch) if pool is not None else map(play_shard, batch)
+        for shard, scores, states in finished: # in shard order within each policy
+            policy = shard[0]
+            if policy in converged:
+                continue
+            shards[shard] = keep_shard(writer, shard, shard_size, scores, states, record_states)
+            stats[policy].add_many(scores); pending[policy].pop(0)
+            bar.next(len(scores))
+            if stats[policy].count >= min_games and half_width(stats[policy], confidence)*2 < width:
+                converged[policy] = True; pending[policy] = []
+    bar.finish()
+    if pool is not None:
+        pool.close(); pool.join()
+    summary = {policy:dict(stats[policy].summary(), **{'Half width':half_width(stats[policy], confidence),
+               'Confidence':confidence, 'Converged':policy in converged}) for policy in policies}
+    return merge_shards(policies, jobs, shards, keep_states), summary
@@ -0,0 +1,129 @@
+import numpy as np, json, struct, hashlib, os
+
+# A policy artifact is MAGIC, a uint32 header length and a JSON header, followed by
+# the uint8 policy and the value array at the offsets recorded in the header. Both
+# arrays are aligned to ALIGN bytes so they can be memory mapped in place.
+MAGIC = b'ALIENPOL'
+ALIGN = 64
+VERSION = 1
+
+class StaleArtifactError(ValueError):
+    """Raised when an artifact was solved for different parameters than requested"""
+
+class CorruptArtifactError(ValueError):
+    """Raised when a file is not a complete policy artifact, ex. one cut short by a killed writer"""
+
+def artifact_path(n, n_boulders):
+    """Default artifact location for an n, n_boulders environment"""
+    return 'PolicyIterationResults/data{}_{}.plc'.format(n, n_boulders)
+
+def state_space_hash(full_states):
+    """Short fingerprint of the packed full states, and so of the state ordering"""
+    return hashlib.sha1(np.ascontiguousarray(full_states, dtype='<i8').tobytes()).hexdigest()[:16]
+
+def aligned(offset):
+    """Rounds offset up to a multiple of ALIGN"""
+    return -(-offset // ALIGN) * ALIGN
+
+def save(path, policy, values, n, n_boulders, gamma, theta, state_hash, stats=None, value_dtype=np.float32):
+    """Writes a policy artifact. The file is written to a temporary name and renamed,
+    so a killed solve leaves the previous artifact or none.
+    Parameters:
+        path: file to write
+        policy: action index of every full state
+        values: value of every full state
+        n: number of rows/columns
+        n_boulders: number of boulders/meteorites per row
+        gamma: discount factor used by the solver
+        theta: stopping condition used by the solver
+        state_hash: state_space_hash of the full states
+        stats: solver stats from PolicyIteration.solve
+        value_dtype: float32 or float64 storage for the values
+    Returns: header dictionary
+    """
+    policy = np.ascontiguousarray(policy, dtype=np.uint8)
+    values = np.ascontiguousarray(values, dtype=np.dtype(value_dtype).newbyteorder('<'))
+    header = {'version':VERSION, 'n':n, 'n_boulders':n_boulders, 'gamma':gamma, 'theta':theta,
+              'state_hash':state_hash, 'n_states':len(policy), 'value_dtype':values.dtype.str, 'stats':stats}
+    # offsets depend on the header length, so size the header with placeholders first
+    header['policy_offset'] = header['values_offset'] = 0
+    prefix = len(MAGIC)+4+len(json.dumps(header))+64
+    header['policy_offset'] = aligned(prefix)
+    header['values_offset'] = aligned(header['policy_offset']+policy.nbytes)
+    raw = json.dumps(header).encode()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path+'.tmp', 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(raw)) + raw)
+        f.write(b'\0'*(header['policy_offset']-f.tell())); f.write(policy.tobytes())
+        f.write(b'\0'*(header['values_offset']-f.tell())); f.write(values.tobytes())
+    os.replace(path+'.tmp', path)
+    return header
+
+def read_header(path):
+    """Reads only the JSON header of an artifact"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise CorruptArtifactError('{} is not a policy artifact'.format(path))
+        try:
+            length, = struct.unpack('<I', f.read(4))
+            return json.loads(f.read(length))
+        except (struct.error, ValueError):
+            raise CorruptArtifactError('{} has a truncated header'.format(path))
+
+def check(header, **expected):
+    """Raises StaleArtifactError when a header field differs from an expected value.
+    Expected values of None are not checked."""
+    for key, want in expected.items():
+        have = header.get(key)
+        if want is None:
+            continue
+        if isinstance(want, float) or isinstance(have, float):
+            same = have is not None and np.isclose(have, want)
+        else:
+            same = have == want
+        if not same:
+            raise StaleArtifactError('Artifact has {}={} but {} was requested'.format(key, have, want))
+
+def check_size(path, header):
+    """Raises CorruptArtifactError when the file is shorter than the arrays its header describes"""
+    end = header['values_offset'] + header['n_states']*np.dtype(header['value_dtype']).itemsize
+    if os.path.getsize(path) < end:
+        raise CorruptArtifactError('{} is truncated, expected {} bytes'.format(path, end))
+
+class Artifact(object):
+    """Memory mapped policy artifact.
+    Attributes:
+        header: metadata written by save
+        policy: uint8 action index of every full state
+        values: value of every full state
+    """
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        nS = self.header['n_states']
+        check_size(path, self.header)
+        self.policy = np.memmap(path, dtype=np.uint8, mode='r', offset=self.header['policy_offset'], shape=(nS,))
+        self.values = np.memmap(path, dtype=np.dtype(self.header['value_dtype']), mode='r',
+                                offset=self.header['values_offset'], shape=(nS,))
+
+def verify(path, n=None, n_boulders=None, gamma=None, theta=None, state_hash=None):
+    """Checks an artifact like load without memory mapping it, so the caller may replace the file
+    Returns: header dictionary
+    """
+    header = read_header(path)
+    check_size(path, header)
+    check(header, n=n, n_boulders=n_boulders, gamma=gamma, theta=theta, state_hash=state_hash)
+    return header
+
+def load(path, n=None, n_boulders=None, gamma=None, theta=None, state_hash=None):
+    """Memory maps an artifact, raising StaleArtifactError when it does not match the request
+    and CorruptArtifactError when it is unreadable.
+    Parameters:
+        path: artifact file
+        n, n_boulders, gamma, theta, state_hash: expected parameters, None skips the check
+    Returns: Artifact
+    """
+    artifact = Artifact(path)
+    check(artifact.header, n=n, n_boulders=n_boulders, gamma=gamma, theta=theta, state_hash=state_hash)
+    return artifact
@@ -1,164 +1,423 @@
-import BoulderMatrix, MovementRewards, numpy as np, pygame, random, json
-from scipy.sparse import csr_matrix, lil_matrix
+import BoulderMatrix, MovementRewards, PolicyArtifact, Symmetry, numpy as np, pygame, random, json, time, os
+from scipy.sparse import csr_matrix, lil_matrix, diags, identity, issparse
+from scipy.sparse.linalg import spsolve, bicgstab, LinearOperator
+from TransitionOperator import TransitionOperator
 from progress.bar import Bar
 
 def alien_movement(alien_p, n, d):
     """Moves alien from one state to another.
     Parameters:
-        alien_p: alien position. Ex. 100 is an alien in the leftmost column of 3
+        alien_p: alien position as a bit index. Ex. 2 is an alien in the leftmost column of 3 ('100')
         n: number of rows/columns
         d: direction of movement
-    Returns: Alien state
+    Returns: Alien position
     """
-    empty_R=['0']*n; empty_L=['0']*n
-    a_index=list(alien_p).index('1')
-    if a_index == 0:
-        empty_R[1]='1'; right=''.join(empty_R)
-        left=alien_p
-    elif a_index == n-1:
-        right = alien_p
-        empty_L[a_index-1]='1'; left = ''.join(empty_L)
-    else:
-        empty_R[a_index+1]='1'; right=''.join(empty_R)
-        empty_L[a_index-1]='1'; left=''.join(empty_L)
-
     if d == 'R':
-        return right
+        return max(alien_p-1, 0)
     elif d == 'L':
-        return left
+        return min(alien_p+1, n-1)
     else:
         return alien_p
 
 def movement_tuples(state, action, n, state_down, boulder_positions, state_reward):
     """Generates movement details for a state.
     Parameters:
-        state: full alien boulder states
+        state: full alien boulder state index
         action: right, left, up in either integer or string
         n: number of rows/columns
-        state_down: possible future states based on movement
+        state_down: possible next boulder state indices for each boulder state index
         boulder_positions: possible boulder positions
-        state_reward: 1 if alive, -5 if dead
-    Returns: tuple of prob, next_state, reward
+        state_reward: 1 if alive, -5 if dead, indexed by full state index
+    Returns: tuple of prob, next_state index, reward
     """
     if type(action)==int:
         action_values = {0:'R', 1:'L', 2:'U'}
         action = action_values[action]
     # moves alien and determines possible new states
-    a_s = alien_movement(state[:n], n, action); p_b_s = state_down[state[n:]]
-    p_states = [a_s+b_s for b_s in p_b_s] # combines into full states
+    nB = len(state_down)
+    a_s = alien_movement(state//nB, n, action); p_b_s = state_down[state%nB]
+    p_states = [a_s*nB+int(b_s) for b_s in p_b_s] # combines into full states
     prob = 1/(len(boulder_positions)-1) # prob of each state
-    return [(prob, ns, state_reward[ns]) for ns in p_states]
+    return [(prob, ns, int(state_reward[ns])) for ns in p_states]
+
+def transition_matrices(n, b_down, state_reward, states=None, column_map=None):
+    """Builds one sparse transition matrix and expected reward vector per action.
+    Parameters:
+        n: number of rows/columns
+        b_down: possible next boulder state indices for each boulder state index
+        state_reward: 1 if alive, -5 if dead, indexed by full state index
+        states: optional full state indices to build rows for, all states when None
+        column_map: optional reduced index of every full state. Successors are
+            mapped through it, so several successors can share a column
+    Returns: list of CSR matrices and [A, rows] array of expected rewards, actions ordered RLU
+    """
+    b_down = np.asarray(b_down); nB, n_next = b_down.shape; nS = n*nB
+    state_reward = np.asarray(state_reward, dtype=float)
+    states = np.arange(nS) if states is None else np.asarray(states)
+    n_rows = len(states); n_cols = nS if column_map is None else int(column_map.max())+1
+    aliens = states // nB; boulders = states % nB
+    moves = BoulderMatrix.alien_movement_table(n)
+    rows = np.repeat(np.arange(n_rows), n_next)
+    data = np.full(n_rows*n_next, 1/n_next)
+    P = []; R = np.zeros((moves.shape[1], n_rows))
+    for a in range(moves.shape[1]):
+        cols = moves[aliens, a][:, None]*nB + b_down[boulders] # [rows, n_next] successor indices
+        R[a] = state_reward[cols].mean(axis=1)
+        if column_map is not None:
+            cols = column_map[cols]
+        P.append(csr_matrix((data, (rows, cols.ravel())), shape=(n_rows, n_cols))) # duplicates are summed
+    return P, R
+
+def policy_matrix(policy, P, R):
+    """Combines the per action model into the model followed by policy.
+    Parameters:
+        policy: [S, A] matrix of action probabilities
+        P: list of [S, S] transition matrices, one per action
+        R: [A, S] expected rewards
+    Returns: [S, S] CSR transition matrix, or a LinearOperator for a
+        TransitionOperator model, and length S expected reward vector
+    """
+    R_pi = (policy * R.T).sum(axis=1)
+    if isinstance(P, TransitionOperator):
+        return P.policy_operator(policy), R_pi
+    P_pi = sum(diags(policy[:, a]) @ P[a] for a in range(len(P)))
+    return csr_matrix(P_pi), R_pi
+
+def rows_dot(M, rows, V):
+    """M[rows] @ V, from one full product when rows are a large share of M"""
+    if len(rows)*3 > M.shape[0]:
+        return (M @ V)[rows]
+    return M[rows] @ V
+
+def prioritized_eval(P_pi, R_pi, gamma, theta, V, band=0.5, dense=0.125):
+    """Asynchronous evaluation by prioritized sweeping. States are ranked by their Bellman
+    error, and each round backs up only the states whose error is within band of the
+    largest. The backed up values of those states and of their predecessors, found
+    through the reverse transition index, are then recomputed, so every state keeps a
+    current target. It stops when no error is above theta, the same condition as a full
+    sweep. When more than a dense share of the states would be backed up, the round is
+    instead a sweep over every state above theta, paid for with one matrix product.
+    It needs fewest backups when the errors are concentrated, ex. an evaluation warm
+    started from the values of a nearby policy: on 5x2 that is 20 to 70 times fewer
+    than 'sweep'. A sweep is a single sparse product here, though, and the reverse
+    index alone costs about eight, so 'sweep' stays 1.2 to 2 times faster in wall time
+    on these boards. Use it to study backup counts, or where backups are the expensive part.
+    Parameters:
+        P_pi: [S, S] CSR transition matrix of the policy
+        R_pi: expected reward of every state
+        gamma: discount factor
+        theta: largest Bellman error allowed
+        V: starting values
+        band: fraction of the largest error a state needs to be backed up in a round
+        dense: share of the states above which a round becomes a sweep
+    Returns: values and the number of state backups
+    """
+    nS = len(V); V = np.array(V, dtype=float)
+    predecessors = None # row s lists the states that can move to s, built on first use
+    targets = R_pi + gamma*(P_pi @ V); errors = np.abs(targets - V); backups = 0
+    while True:
+        top = errors.max() if nS else 0.0
+        if top <= theta:
+            return V, backups
+        batch = np.flatnonzero(errors >= max(top*band, theta))
+        if len(batch) > dense*nS:
+            batch = np.flatnonzero(errors > theta)
+        V[batch] = targets[batch]
+        backups += len(batch)
+        if len(batch) > dense*nS:
+            targets = R_pi + gamma*(P_pi @ V); errors = np.abs(targets - V)
+            continue
+        if predecessors is None:
+            predecessors = csr_matrix(P_pi.T)
+        changed = np.zeros(nS, dtype=bool); changed[batch] = True
+        changed[predecessors[batch].indices] = True
+        changed = np.flatnonzero(changed)
+        targets[changed] = R_pi[changed] + gamma*rows_dot(P_pi, changed, V)
+        errors[changed] = np.abs(targets[changed] - V[changed])
 
-def policy_eval(policy, nS, nA, P, full_state_to_index, gamma=1, theta=0.05):
+def policy_eval(policy, P, R, gamma=1, theta=0.05, method='sweep', V=None, stats=None):
     """Evaluate a policy.
     Parameters:
         policy: [S, A] matrix. Each row is a state and each col is an action
-        P[s][a]: is list of transitional tuples (prob, next_state, reward)
-        nS: number of states in environment
-        nA: number of actions
+        P: list of [S, S] sparse transition matrices, one per action, or a TransitionOperator
+        R: [A, S] expected rewards of taking each action in each state
         theta: stop evaluation once function change is less than or equal to this value
         gamma: discount factor
+        method: 'sweep' repeats sparse backups until theta is met,
+            'direct' solves (I - gamma P_pi) V = R_pi with a sparse LU factorization,
+            'iterative' solves the same system with BiCGSTAB,
+            'prioritized' backs up only the states with the largest Bellman errors. It needs far
+            fewer backups but is slower than 'sweep' on these boards, see prioritized_eval.
+            A TransitionOperator model supports 'sweep' and 'iterative'
+        V: optional starting value function for 'sweep', 'iterative' and 'prioritized'
+        stats: optional solver stats whose 'Backups' count the state backups of 'sweep' and 'prioritized'
 
     returns: vector of length nS representing value function
     """
-    V = np.zeros(nS)
-    while True:
-        delta = 0
-        for s in range(nS):
-            value = 0
-            # for each action, iterate over possible next states
-            for a, a_prob in enumerate(policy[s]):
-                for prob, ns, reward in P[s][a]:
-                    # calculate expected value
-                    value += a_prob * prob * (reward+gamma*V[full_state_to_index[ns]])
-            delta = max(delta, np.abs(value-V[s]))
-            V[s] = value
-        if delta <= theta: #end condition
-            break
+    P_pi, R_pi = policy_matrix(policy, P, R)
+    nS = len(R_pi)
+    V = np.zeros(nS) if V is None else np.array(V, dtype=float)
+    if method == 'direct':
+        if not issparse(P_pi):
+            raise ValueError("'direct' evaluation needs sparse transition matrices")
+        return spsolve(identity(nS, format='csc') - gamma*P_pi.tocsc(), R_pi)
+    if method == 'iterative':
+        if issparse(P_pi):
+            A = identity(nS, format='csr') - gamma*P_pi
+        else:
+            A = LinearOperator((nS, nS), matvec=lambda x: x - gamma*(P_pi @ x), dtype=float)
+        V, info = bicgstab(A, R_pi, x0=V, atol=theta*(1-gamma))
+        if info != 0:
+            raise RuntimeError('BiCGSTAB did not converge (info={})'.format(info))
+        return V
+    if method == 'prioritized':
+        if not issparse(P_pi):
+            raise ValueError("'prioritized' evaluation needs sparse transition matrices")
+        V, backups = prioritized_eval(P_pi, R_pi, gamma, theta, V)
+    else:
+        backups = 0
+        while True:
+            new_V = R_pi + gamma*(P_pi @ V)
+            delta = np.abs(new_V-V).max()
+            V = new_V; backups += nS
+            if delta <= theta: #end condition
+                break
+    if stats is not None:
+        stats['Backups'] = stats.get('Backups', 0) + backups
     return V
 
-def value(s, V, full_state_to_index, nA, P, gamma = 1, theta=0.05):
-    """Helper function that calculates value for all actions for a given state.
+def value(V, P, R, gamma = 1):
+    """Helper function that calculates value for all actions in every state.
     Parameters:
-        s: state index
         V: Value
-        full_state_to_index: dictionary of state to index Values
-        nA: number of actions (3)
-        P: transitional tuples given state and action
+        P: list of [S, S] sparse transition matrices, one per action, or a TransitionOperator
+        R: [A, S] expected rewards
         gamma: discount factor
-        theta: stopping conditions
-    Returns: A"""
-    A = np.zeros(nA)
-    for a in range(nA):
-        for prob, ns, reward in P[s][a]:
-            A[a] += prob * (reward + gamma * V[full_state_to_index[ns]])
-    return A
-
-def policy_improvement(nS, nA, P, full_state_to_index, g=.75,t=0.05):
+    Returns: [S, A] array of action values"""
+    if isinstance(P, TransitionOperator): # one pass for all actions
+        return (R + gamma*P.expected_next(V)).T
+    return np.stack([R[a] + gamma*(P[a] @ V) for a in range(len(P))], axis=1)
+
+def greedy_actions(action_values, chosen_a=None):
+    """Picks the best action in every state, keeping chosen_a where it is already tied for best.
+    Parameters:
+        action_values: [S, A] array of action values
+        chosen_a: optional length S array of current actions
+    Returns: length S array of actions"""
+    best_a = np.argmax(action_values, axis=1)
+    if chosen_a is not None:
+        rows = np.arange(len(best_a))
+        keep = np.isclose(action_values[rows, chosen_a], action_values[rows, best_a])
+        best_a = np.where(keep, chosen_a, best_a)
+    return best_a
+
+def new_stats(solver):
+    """Creates the per run report filled in by the solvers"""
+    return {'Solver':solver, 'Iterations':0, 'Residuals':[], 'Times':[]}
+
+def record(stats, residual, start):
+    """Adds one iteration with its Bellman residual and wall time to stats"""
+    stats['Iterations'] += 1
+    stats['Residuals'].append(float(residual))
+    stats['Times'].append(time.perf_counter()-start)
+    if stats['Iterations']%100==0:
+        print(stats['Iterations'])
+
+def save_checkpoint(path, actions, V, stats, g, t):
+    """Writes the current actions, values and stats of a solve. The file is written
+    to a temporary name and renamed, so a killed run leaves the previous checkpoint"""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path+'.tmp', 'wb') as f:
+        np.savez(f, actions=np.asarray(actions, dtype=np.uint8), V=V, stats=json.dumps(stats), g=g, t=t)
+    os.replace(path+'.tmp', path)
+
+def load_checkpoint(path):
+    """Reads a checkpoint written by save_checkpoint
+    Returns: dictionary of actions, V, stats, g and t"""
+    with np.load(path) as data:
+        return {'actions':data['actions'].astype(np.intp), 'V':data['V'], 'stats':json.loads(str(data['stats'])),
+                'g':float(data['g']), 't':float(data['t'])}
+
+def policy_improvement(P, R, g=.75,t=0.05, method='sweep', max_iter=10000, policy=None, V=None,
+                       checkpoint=None, checkpoint_every=10, resume=False):
     """Iteratively evaluates and improves a policy until an optimal policy is found
-    or reaches threshold of iterations
+    or reaches threshold of iterations (exact policy iteration)
     Parameters:
-        nS: number of states
-        nA: number of actions
-        P: transitional tuples given state and action
-        full_state_to_index: dictionary of state to index Values
+        P: list of [S, S] sparse transition matrices, one per action
+        R: [A, S] expected rewards
         g: gamma which is discount factor
         t: theta or stopping condition
-    Returns: tuple of policy and value of policy
+        method: policy evaluation method, see policy_eval
+        max_iter: maximum number of improvement steps
+        policy: optional action index of every state to start from instead of the random
+            policy, ex. the policy of an artifact solved for a nearby gamma or theta
+        V: optional values to start the first evaluation from
+        checkpoint: optional file the actions, values and stats are saved to every
+            checkpoint_every iterations
+        resume: continue from checkpoint when it exists, ignoring policy and V. The checkpoint
+            must have been written with the same g and t
+    Returns: tuple of policy, value of policy and solver stats
     """
-    policy = np.ones([nS, nA]) / nA # random policy (equal chance all actions)
+    nA, nS = R.shape
+    chosen_a = None; stats = new_stats('policy_iteration')
+    if resume and checkpoint is not None and os.path.exists(checkpoint):
+        saved = load_checkpoint(checkpoint)
+        if len(saved['V']) != nS:
+            raise ValueError('Checkpoint {} has {} states but the model has {}'.format(checkpoint, len(saved['V']), nS))
+        if (saved['g'], saved['t']) != (g, t):
+            raise ValueError('Checkpoint {} was written with g={} and t={} but this run has g={} and t={}'.format(
+                checkpoint, saved['g'], saved['t'], g, t))
+        policy, V, stats = saved['actions'], None, saved['stats'] # evaluations start from zero, as in the interrupted run
+        print('Resuming from iteration', stats['Iterations'])
+    start_V = V
+    if policy is None:
+        policy = np.ones([nS, nA]) / nA # random policy (equal chance all actions)
+    else:
+        chosen_a = np.asarray(policy, dtype=np.intp)
+        policy = np.eye(nA)[chosen_a]
 
-    i=0
     while True:
-        i+=1
-        if i%100==0:
-            print(i)
-        V = policy_eval(policy, nS, nA, P, full_state_to_index,  gamma=g, theta=t) # eval current policy
-        is_policy_stable = True # true is no changes false if we make changes
-
-        for s in range(nS):
-            chosen_a = np.random.choice(np.argwhere(policy[s] == np.amax(policy[s])).flatten().tolist())
-            action_values = value(s, V, full_state_to_index, nA, P, gamma=g, theta=t)
-            best_a = np.random.choice(np.argwhere(action_values == np.amax(action_values)).flatten().tolist())
-            if chosen_a != best_a: # greedy update
-                is_policy_stable = False
-            policy[s] = np.eye(nA)[best_a]
-        if is_policy_stable or i==10000:
-            print(i, 'Iterations')
-            return policy, V
-
-def main(n, n_boulders, b_down, state_to_index, index_to_state, boulder_positions, state_reward, full_states):
-    """Finds and saves optimal policy and values to json file.
+        start = time.perf_counter()
+        V = policy_eval(policy, P, R, gamma=g, theta=t, method=method, V=start_V, stats=stats) # eval current policy
+        start_V = None # later evaluations start from zero as in a cold solve
+        action_values = value(V, P, R, gamma=g)
+        best_a = greedy_actions(action_values, chosen_a)
+        is_policy_stable = chosen_a is not None and np.array_equal(chosen_a, best_a)
+        chosen_a = best_a
+        policy = np.eye(nA)[best_a] # greedy update
+        record(stats, np.abs(action_values.max(axis=1)-V).max(), start)
+        if checkpoint is not None and stats['Iterations'] % checkpoint_every == 0:
+            save_checkpoint(checkpoint, chosen_a, V, stats, g, t)
+        if is_policy_stable or stats['Iterations']>=max_iter:
+            print(stats['Iterations'], 'Iterations')
+            return policy, V, stats
+
+def value_iteration(P, R, g=.75, t=0.05, max_iter=10000, V=None):
+    """Applies Bellman optimality backups until the value changes by at most t
+    Parameters:
+        P: list of [S, S] sparse transition matrices, one per action
+        R: [A, S] expected rewards
+        g: gamma which is discount factor
+        t: theta or stopping condition
+        max_iter: maximum number of backups
+        V: optional starting values
+    Returns: tuple of policy, value of policy and solver stats
+    """
+    return modified_policy_iteration(P, R, g=g, t=t, k=1, max_iter=max_iter, solver='value_iteration', V=V)
+
+def modified_policy_iteration(P, R, g=.75, t=0.05, k=5, max_iter=10000, solver='modified_policy_iteration', V=None):
+    """Alternates a greedy improvement with k partial evaluation sweeps of the improved policy.
+    k=1 is value iteration and a large k approaches exact policy iteration.
+    Parameters:
+        P: list of [S, S] sparse transition matrices, one per action
+        R: [A, S] expected rewards
+        g: gamma which is discount factor
+        t: theta or stopping condition on the Bellman residual
+        k: number of evaluation sweeps per improvement
+        max_iter: maximum number of improvement steps
+        V: optional starting values, ex. from an artifact solved for a nearby gamma
+    Returns: tuple of policy, value of policy and solver stats
+    """
+    nA, nS = R.shape
+    V = np.zeros(nS) if V is None else np.array(V, dtype=float); chosen_a = None; stats = new_stats(solver)
+
+    while True:
+        start = time.perf_counter()
+        action_values = value(V, P, R, gamma=g)
+        chosen_a = greedy_actions(action_values, chosen_a)
+        residual = np.abs(action_values.max(axis=1)-V).max()
+        V = action_values[np.arange(nS), chosen_a]
+        if k > 1:
+            P_pi, R_pi = policy_matrix(np.eye(nA)[chosen_a], P, R)
+            for sweep in range(k-1):
+                V = R_pi + g*(P_pi @ V)
+        record(stats, residual, start)
+        if residual <= t or stats['Iterations']==max_iter:
+            print(stats['Iterations'], 'Iterations')
+            return np.eye(nA)[chosen_a], V, stats
+
+SOLVERS = {'policy_iteration':policy_improvement,
+           'value_iteration':value_iteration,
+           'modified_policy_iteration':modified_policy_iteration}
+
+def solve(P, R, solver='policy_iteration', g=.75, t=0.05, **options):
+    """Runs one of the SOLVERS on the model.
+    Parameters:
+        P: list of [S, S] sparse transition matrices, one per action
+        R: [A, S] expected rewards
+        solver: 'policy_iteration', 'value_iteration' or 'modified_policy_iteration'
+        g: gamma which is discount factor
+        t: theta or stopping condition
+        options: solver specific arguments such as method, k or max_iter
+    Returns: tuple of policy, value of policy and solver stats
+    """
+    if solver not in SOLVERS:
+        raise ValueError('Unknown solver {}. Choose from {}'.format(solver, list(SOLVERS)))
+    return SOLVERS[solver](P, R, g=g, t=t, **options)
+
+def solve_symmetric(n, b_down, state_reward, full_states, boulder_positions, solver='policy_iteration', g=.75, t=0.05, **options):
+    """Solves on one state of every mirror pair and reflects the policy back, see Symmetry.
+    Parameters:
+        n: number of rows/columns
+        b_down: possible next boulder state indices for each boulder state index
+        state_reward: 1 if alive, -5 if dead, indexed by full state index
+        full_states: all possible states given n and n_boulders
+        boulder_positions: possible boulder states
+        solver, g, t, options: passed on to solve. A policy or V warm start is given for every full state
+    Returns: tuple of action index per state, value per state and solver stats
+    """
+    mirror = Symmetry.mirror_states(n, full_states, boulder_positions)
+    reps, column_map = Symmetry.canonical_states(mirror)
+    for warm in ['policy', 'V']: # warm starts cover every state, each representative keeps its own entry
+        if options.get(warm) is not None:
+            options[warm] = np.asarray(options[warm])[reps]
+    P, R = transition_matrices(n, b_down, state_reward, states=reps, column_map=column_map)
+    policy, v, stats = solve(P, R, solver=solver, g=g, t=t, **options)
+    stats['Solved states'] = len(reps)
+    actions, v = Symmetry.expand(np.argmax(policy, axis=1), v, mirror, column_map)
+    return actions, v, stats
+
+def main(n, n_boulders, b_down, boulder_positions, state_reward, full_states,
+         solver='policy_iteration', g=.5, t=0.05, symmetry=True, matrix_free=False, warm_start=None, path=None, **options):
+    """Finds and saves optimal policy and values to a policy artifact.
     Parameters:
         n: number of rows/columns
         b_down: possible next boulder states
-        state_to_index/index_to_state: dictionaries to convert states to index
         boulder_positions: possible boulder states
         state_reward: reward of moving to state
         full_states: all possible states given n and n_boulders
-    Returns: None
+        solver, g, t, options: passed on to solve
+        symmetry: solve on half the states with solve_symmetric
+        matrix_free: solve with a TransitionOperator instead of stored matrices, ignores symmetry
+        warm_start: optional artifact of the same environment, solved for any gamma or theta,
+            whose policy and values the solve starts from. It may be path itself
+        path: artifact file, PolicyArtifact.artifact_path when None
+    Returns: solver stats
     """
-    actions = [0,1,2]; state_down = {}; full_state_to_index={}; nS = len(full_states); nA = len(actions)
-    # gen conversion dictionaries
-    for k,v in b_down.items():
-        vals = [index_to_state[a] for a in v]
-        state_down[index_to_state[k]] = vals
-    for s in range(len(full_states)):
-        full_state_to_index[full_states[s]] = s
-    # create P
-    P=[]
-    for state in full_states:
-        action_list=[]
-        for a in actions:
-            action_list.append(movement_tuples(state,a, n, state_down, boulder_positions, state_reward))
-        P.append(action_list)
-
-    policy, v = policy_improvement(nS, nA, P, full_state_to_index, g = .5)
-    policy_actions = [int(np.argmax(p)) for p in policy]
-    data = {'Policy':policy_actions, 'Values':v.tolist()}
-
-    with open('PolicyIterationResults/data{}_{}.json'.format(n,n_boulders), 'w') as f:
-        json.dump(data, f)
-
-    print(policy_actions.count(0),policy_actions.count(1),policy_actions.count(2))
-#main(n, n_boulders, b_down, state_to_index, index_to_state, boulder_positions, state_reward, full_states)
+    if warm_start is not None:
+        try:
+            artifact = PolicyArtifact.load(warm_start, n=n, n_boulders=n_boulders, state_hash=PolicyArtifact.state_space_hash(full_states))
+            if solver == 'policy_iteration':
+                options['policy'] = np.array(artifact.policy)
+            options['V'] = np.array(artifact.values, dtype=float)
+            del artifact # unmaps the file, so the save below can replace it on Windows too
+            print('Warm start from', warm_start)
+        except (FileNotFoundError, PolicyArtifact.StaleArtifactError, PolicyArtifact.CorruptArtifactError):
+            print('Cannot warm start from', warm_start)
+    if matrix_free:
+        P = TransitionOperator(n, boulder_positions)
+        policy, v, stats = solve(P, P.rewards(), solver=solver, g=g, t=t, **options)
+        policy_actions = np.argmax(policy, axis=1)
+    elif symmetry:
+        policy_actions, v, stats = solve_symmetric(n, b_down, state_reward, full_states, boulder_positions,
+                                                   solver=solver, g=g, t=t, **options)
+    else:
+        P, R = transition_matrices(n, b_down, state_reward)
+        policy, v, stats = solve(P, R, solver=solver, g=g, t=t, **options)
+        policy_actions = np.argmax(policy, axis=1)
+    PolicyArtifact.save(path or PolicyArtifact.artifact_path(n, n_boulders), policy_actions, v, n, n_boulders, g, t,
+                        PolicyArtifact.state_space_hash(full_states), stats)
+
+    print(*np.bincount(policy_actions, minlength=3))
+    return stats
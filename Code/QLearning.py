@@ -0,0 +1,144 @@
+import BoulderMatrix, Environment, PolicyArtifact, numpy as np
+import argparse, time
+
+# Model-free tabular learning from batches of games. Every step plays one action in
+# each of n_envs games, and all their transitions update the Q table at once. When
+# several games update the same state and action in one step, their TD errors are
+# averaged so a batch moves an entry no further than a single update would. Collisions
+# are terminal: their target is the -5 reward alone and the game they end is restarted
+# for the next step. PolicyIteration instead keeps playing through collisions, so the
+# learned values are not comparable with solved values, only the greedy actions are.
+
+def constant(value):
+    """Schedule returning value at every step"""
+    return lambda step: value
+
+def linear(start, end, steps):
+    """Schedule going linearly from start to end over steps, then staying at end"""
+    return lambda step: end + (start-end)*max(0.0, 1-step/steps)
+
+def exponential(start, end, rate):
+    """Schedule multiplying start by rate every step, down to end"""
+    return lambda step: max(end, start*rate**step)
+
+def epsilon_greedy(Q, states, epsilon, rng):
+    """Greedy actions of Q, replaced by random actions with probability epsilon"""
+    actions = Q[states].argmax(axis=1)
+    explore = rng.random(len(states)) < epsilon
+    actions[explore] = rng.integers(0, Q.shape[1], size=int(explore.sum()))
+    return actions
+
+def update(Q, states, actions, targets, alpha):
+    """Moves Q[states, actions] towards targets, averaging duplicate entries"""
+    keys, inverse = np.unique(states*Q.shape[1]+actions, return_inverse=True)
+    errors = np.bincount(inverse, weights=targets-Q[states, actions]) / np.bincount(inverse)
+    Q.reshape(-1)[keys] += (alpha*errors).astype(Q.dtype)
+
+def evaluate(policy, n, n_boulders, n_games=2000, seed=None, max_turns=10000):
+    """Mean score of a deterministic policy over n_games games
+    Parameters:
+        policy: action index of every full state
+        n: number of rows/columns
+        n_boulders: number of boulders/meteorites per row
+        n_games: number of games
+        seed: seed of the games
+        max_turns: cap on turns per game, for policies that can survive forever.
+            Games still alive after max_turns end with a score of max_turns
+    Returns: mean score and number of games that reached max_turns
+    """
+    env = Environment.BatchEnvironment(n, n_boulders, n_games, seed)
+    states = env.reset(); total = 0; turn = 0
+    while env.n_envs and turn != max_turns:
+        states, rewards, hit = env.step(policy[states])
+        total += int((~hit).sum())
+        env.keep(~hit); states = states[~hit]
+        turn += 1
+    return total/n_games, env.n_envs
+
+def train(n, n_boulders, method='q_learning', g=.5, alpha=constant(0.1), epsilon=linear(1.0, 0.05, 2000),
+          n_envs=1024, n_steps=5000, eval_every=500, eval_games=2000, eval_turns=10000, seed=None, Q=None):
+    """Learns Q from batches of games without a transition model.
+    Parameters:
+        n: number of rows/columns
+        n_boulders: number of boulders/meteorites per row
+        method: q_learning (off policy, bootstraps from the best next action) or
+            sarsa (on policy, bootstraps from the next action taken)
+        g: discount factor
+        alpha: learning rate schedule, a function of the step
+        epsilon: exploration schedule, a function of the step
+        n_envs: games played at once
+        n_steps: batched steps, so n_envs*n_steps transitions
+        eval_every: steps between evaluations of the greedy policy, 0 to skip
+        eval_games: games per evaluation
+        eval_turns: turn cap of the evaluation games
+        seed: seed of the training and evaluation games
+        Q: optional [nS, 3] float32 table to continue from
+    Returns: Q and stats
+    """
+    if method not in ('q_learning', 'sarsa'):
+        raise ValueError('Unknown method {}, expected q_learning or sarsa'.format(method))
+    env = Environment.BatchEnvironment(n, n_boulders, n_envs, seed)
+    Q = np.zeros((env.n_states, env.n_actions), dtype=np.float32) if Q is None else Q
+    rng = np.random.default_rng(seed)
+    stats = {'Solver':method, 'Iterations':0, 'Transitions':0, 'Evaluations':[], 'Times':[]}
+    start = time.perf_counter()
+    states = env.reset(); actions = epsilon_greedy(Q, states, epsilon(0), rng)
+    for step in range(1, n_steps+1):
+        next_states, rewards, hit = env.step(actions)
+        next_actions = epsilon_greedy(Q, next_states, epsilon(step), rng)
+        if method == 'q_learning':
+            bootstrap = Q[next_states].max(axis=1)
+        else:
+            bootstrap = Q[next_states, next_actions]
+        update(Q, states, actions, rewards + g*np.where(hit, 0, bootstrap), alpha(step)) # collisions are terminal
+        if hit.any(): # finished games start over
+            next_states = env.restart(hit)
+            next_actions[hit] = epsilon_greedy(Q, next_states[hit], epsilon(step), rng)
+        states, actions = next_states, next_actions
+        stats['Iterations'] = step; stats['Transitions'] += n_envs
+        if eval_every and (step % eval_every == 0 or step == n_steps):
+            score, survived = evaluate(Q.argmax(axis=1), n, n_boulders, eval_games,
+                                       None if seed is None else seed+step, eval_turns)
+            stats['Evaluations'].append({'Step':step, 'Epsilon':float(epsilon(step)), 'Score':score, 'Survived':survived})
+            stats['Times'].append(time.perf_counter()-start)
+            print('Step {}: epsilon {:.3f}, greedy policy averaged {:.2f}, {} of {} games reached {} turns'.format(
+                step, epsilon(step), score, survived, eval_games, eval_turns))
+    return Q, stats
+
+def main(n, n_boulders, path=None, **options):
+    """Trains a policy and saves it as a policy artifact, loadable with CompiledPolicy.load.
+    The saved values are the learned Q values, with collisions terminal, so they are not
+    comparable with the values of a PolicyIteration artifact.
+    Parameters:
+        n: number of rows/columns
+        n_boulders: number of boulders/meteorites per row
+        path: artifact file, PolicyIterationResults/<method><n>_<n_boulders>.plc when None
+        options: passed on to train
+    Returns: training stats
+    """
+    Q, stats = train(n, n_boulders, **options)
+    path = path or 'PolicyIterationResults/{}{}_{}.plc'.format(stats['Solver'], n, n_boulders)
+    env = Environment.BatchEnvironment(n, n_boulders, 0)
+    aliens = np.arange(env.n_states) // env.nB
+    boulders = BoulderMatrix.unrank_states(np.arange(env.n_states) % env.nB, n, env.boulder_positions)
+    state_hash = PolicyArtifact.state_space_hash((aliens << (n*n)) | boulders)
+    PolicyArtifact.save(path, Q.argmax(axis=1), Q.max(axis=1), n, n_boulders, options.get('g', .5), None, state_hash, stats)
+    print('Saved', path)
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Model-free Q-learning or SARSA from batched games')
+    parser.add_argument('n', type=int); parser.add_argument('n_boulders', type=int)
+    parser.add_argument('--method', default='q_learning', choices=['q_learning', 'sarsa'])
+    parser.add_argument('--gamma', type=float, default=.5)
+    parser.add_argument('--alpha', type=float, default=0.1)
+    parser.add_argument('--epsilon', type=float, nargs=3, default=[1.0, 0.05, 2000], metavar=('START', 'END', 'STEPS'),
+                        help='linear exploration schedule')
+    parser.add_argument('--envs', type=int, default=1024); parser.add_argument('--steps', type=int, default=5000)
+    parser.add_argument('--eval-every', type=int, default=500); parser.add_argument('--eval-turns', type=int, default=10000)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--path')
+    args = parser.parse_args()
+    main(args.n, args.n_boulders, args.path, method=args.method, g=args.gamma, alpha=constant(args.alpha),
+         epsilon=linear(*args.epsilon), n_envs=args.envs, n_steps=args.steps, eval_every=args.eval_every,
+         eval_turns=args.eval_turns, seed=args.seed)
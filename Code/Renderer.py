@@ -0,0 +1,124 @@
+import pygame, numpy as np, os, shutil
+
+# Draws the game with sprites that are loaded and scaled once. Each frame restores
+# the background under the sprites of the previous frame, blits the new sprites and
+# updates only those rects. With headless=True the SDL dummy video driver is used,
+# so frames can be rendered and captured on servers without a display.
+FIGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'figs')
+SPRITE = 50 # sprite size on a 600 pixel screen
+
+def cell_positions(n, size=600):
+    """Pixel offset of each row/column, centring a sprite in its cell"""
+    sprite = SPRITE*size//600
+    return [int((size/n-sprite)/2+size/n*i) for i in range(n)]
+
+class ImageSequence(object):
+    """Saves every frame as a numbered image file. The extension of pattern picks the
+    format, .bmp is much faster to write than .png"""
+    def __init__(self, directory, pattern='frame_{:06d}.png'):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory; self.pattern = pattern; self.count = 0
+
+    def write(self, surface):
+        pygame.image.save(surface, os.path.join(self.directory, self.pattern.format(self.count)))
+        self.count += 1
+
+    def close(self):
+        return self.directory
+
+class ArrayStream(object):
+    """Collects frames as (height, width, 3) uint8 arrays. With a path, frames are streamed
+    to disk and become one .npy array of every frame on close. Without one they are kept
+    in memory and returned by close."""
+    def __init__(self, path=None):
+        self.path = path; self.count = 0; self.shape = None; self.frames = []
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.f = open(path+'.part', 'wb')
+
+    def write(self, surface):
+        pixels = pygame.surfarray.pixels3d(surface) # (width, height, 3) view, locks the surface
+        frame = np.ascontiguousarray(pixels.swapaxes(0, 1)); del pixels
+        self.shape = frame.shape; self.count += 1
+        if self.path is None:
+            self.frames.append(frame)
+        else:
+            self.f.write(frame.tobytes())
+
+    def close(self):
+        """Returns the array of frames, or the path of the .npy file"""
+        if self.path is None:
+            return np.stack(self.frames) if self.frames else np.empty((0, 0, 0, 3), dtype=np.uint8)
+        self.f.close()
+        with open(self.path, 'wb') as f, open(self.path+'.part', 'rb') as part:
+            np.lib.format.write_array_header_1_0(f, {'descr':'|u1', 'fortran_order':False,
+                                                     'shape':(self.count,)+(self.shape or (0, 0, 3))})
+            shutil.copyfileobj(part, f)
+        os.remove(self.path+'.part')
+        return self.path
+
+class Renderer(object):
+    """Screen with cached sprites and dirty rect updates.
+    Attributes:
+        reset: clears the screen for a new game
+        draw: draws the alien and boulders of one turn
+        close: finishes the capture and returns its result
+    """
+    def __init__(self, n, size=600, headless=False, capture=None):
+        """Opens the screen and loads the sprites
+        Parameters:
+            n: number of rows/columns
+            size: screen width and height in pixels
+            headless: use the SDL dummy video driver
+            capture: optional ImageSequence or ArrayStream given every frame
+        """
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        pygame.init()
+        self.n = n; self.headless = headless; self.capture = capture
+        self.screen = pygame.display.set_mode((size, size))
+        sprite = (SPRITE*size//600,)*2
+        self.background = pygame.transform.scale(pygame.image.load(os.path.join(FIGS, 'icon.png')), (size, size)).convert()
+        self.meteorite = pygame.transform.scale(pygame.image.load(os.path.join(FIGS, 'meteorite.png')), sprite).convert_alpha()
+        self.alien = pygame.transform.scale(pygame.image.load(os.path.join(FIGS, 'alien.png')), sprite).convert_alpha()
+        p = cell_positions(n, size)
+        # bit b of a packed boulder state is row (n*n-1-b)//n, column (n*n-1-b)%n counted from the top left
+        self.boulder_cells = [(p[(n*n-1-b) % n], p[(n*n-1-b)//n]) for b in range(n*n)]
+        self.alien_cells = [(p[position], p[n-1]) for position in range(n)]
+        self.dirty = []; self.full = True
+
+    def reset(self):
+        """Clears every sprite, the next draw updates the whole screen"""
+        self.screen.blit(self.background, (0, 0))
+        self.dirty = []; self.full = True
+
+    def draw(self, position, boulders):
+        """Draws one turn
+        Parameters:
+            position: screen column of the alien
+            boulders: packed boulder state
+        Returns: list of rects that changed
+        """
+        for rect in self.dirty: # background under the previous sprites
+            self.screen.blit(self.background, rect, rect)
+        rects = [self.screen.blit(self.alien, self.alien_cells[position])]
+        boulders = int(boulders)
+        while boulders: # one meteorite per set bit, lowest bit first
+            low = boulders & -boulders
+            rects.append(self.screen.blit(self.meteorite, self.boulder_cells[low.bit_length()-1]))
+            boulders ^= low
+        changed = self.dirty + rects; self.dirty = rects
+        if not self.headless:
+            pygame.display.update(None if self.full else changed)
+        self.full = False
+        if self.capture is not None:
+            self.capture.write(self.screen)
+        return changed
+
+    def close(self):
+        """Finishes the capture
+        Returns: the capture result, or None without a capture"""
+        result = self.capture.close() if self.capture is not None else None
+        self.capture = None
+        return result
@@ -1,27 +1,80 @@
-from policies import Policies
-from scipy.sparse import lil_matrix
+from policies import Policies, CompiledPolicy
 from progress.bar import Bar
-import BoulderMatrix, MovementRewards, json, pygame, sys, numpy as np, random, time, datetime, os
+import Instrumentation, ParallelSimulation, PolicyArtifact, TrajectoryLog, BoulderMatrix, Environment, ModelCache, json, pygame, sys, numpy as np, random, time, datetime, os
 
 # Globals for easy testing
 
 n=4 # number of rows/columns
 n_boulders=2 # number of boulders/meteorites per row
-n_iterations= 10000 # number of iterations in the simulation
+gamma=.5 # discount factor of the RL policy
+theta=0.05 # stopping condition of the RL policy
+n_iterations= 10000 # number of iterations in the simulation, the cap per policy when ci_width is set
+ci_width=None # stop each policy once the confidence interval on its mean score is narrower than this, None plays n_iterations games
+confidence=0.95 # confidence level of ci_width
+max_turns=10000 # turn cap of every simulated game, policies that never die score max_turns
 delay=0 # adds delay between turns.... artifact of visual simulation
+n_processes=None # worker processes for Simulations, None uses every core
+seed=None # seed for reproducible Simulations, None draws fresh entropy
+record_states=True # log every state of every game, False keeps only the scores
+profile=False # time each phase of GameLoop and report at the end of Simulations
+profile_games=200 # GameLoop games per policy timed by Simulations when profile is on
 
-# Calculate state matrices
+profiler = Instrumentation.PhaseTimer() # phase timings of every profiled game
 
-B, b_down, state_to_index, index_to_state, state_space, boulder_positions, alien_positions, collisions, state_reward, full_states = BoulderMatrix.main(n,n_boulders)
-movement_rewards = MovementRewards.main(n, full_states)
+compiled_policies = {} # policies are compiled once and reused by every game
 
-try:
-    fh = open('PolicyIterationResults/data{}_{}.json'.format(n,n_boulders), 'r') # tries to read in policy
+def setup(size, boulders, policy=None):
+    """Loads the state matrices and the RL policy for an environment, solving the policy if needed.
+    Sets the module globals used by GameLoop and Simulations, so it is called before either.
+    Parameters:
+        size: number of rows/columns
+        boulders: number of boulders/meteorites per row
+        policy: optional RL action index of every full state, played instead of the saved
+            artifact, which is then neither read, solved nor written
+    """
+    global n, n_boulders, model, B, b_down, state_space, boulder_positions, collisions, state_reward, full_states, movement_rewards, policy_path, env, p_values, p_matrix
+    n, n_boulders = size, boulders
+    model = ModelCache.load(n, n_boulders) # built once per configuration, then read from the cache
+    B, b_down, state_space, boulder_positions, collisions, state_reward, full_states = model.B, model.b_down, model.state_space, model.boulder_positions, model.collisions, model.state_reward, model.full_states
+    movement_rewards = model.movement_rewards
+    compiled_policies.clear()
+    env = Environment.AlienMeteoriteEnv(n, n_boulders, seed=seed, model=model) # reused by every GameLoop
+    p_values=calculate_indices(n)
+    p_matrix=np.matrix([[(x,y) for x in list(p_values.values())] for y in list(p_values.values())], dtype=np.dtype('int,int'))
+
+    if policy is not None:
+        compiled_policies["RL"] = CompiledPolicy.from_actions(policy)
+        policy_path = None
+        return
+    policy_path = PolicyArtifact.artifact_path(n, n_boulders)
+    try: # tries to read in a policy solved for these parameters
+        PolicyArtifact.verify(policy_path, n=n, n_boulders=n_boulders, gamma=gamma, theta=theta,
+                              state_hash=PolicyArtifact.state_space_hash(full_states))
+
+    except (FileNotFoundError, PolicyArtifact.CorruptArtifactError): # if missing or unreadable, optimizes policy for n, n_boulders combinations
+        import PolicyIteration
+        print("Optimizing Policy")
+        PolicyIteration.main(n, n_boulders, b_down, boulder_positions, state_reward, full_states,
+                             g=gamma, t=theta)
+    except PolicyArtifact.StaleArtifactError: # solved for another gamma or theta, so it is retuned from there
+        import PolicyIteration
+        print("Retuning Policy")
+        PolicyIteration.main(n, n_boulders, b_down, boulder_positions, state_reward, full_states,
+                             g=gamma, t=theta, warm_start=policy_path)
 
-except FileNotFoundError: # if fails, optimizes policy for n, n_boulders combinations
-    import PolicyIteration
-    print("Optimizing Policy")
-    PolicyIteration.main(n, n_boulders, b_down, state_to_index, index_to_state, boulder_positions, state_reward, full_states)
+
+def load_policy(policy):
+    """Compiles the Random, Greedy, or RL policy on first use
+    Parameters:
+        policy: Random, Greedy, GreedyK, or RL
+    Returns: CompiledPolicy
+    """
+    if policy not in compiled_policies:
+        if policy=="RL":
+            compiled_policies[policy] = CompiledPolicy.load(policy_path)
+        else:
+            compiled_policies[policy] = Policies.compile(policy, movement_rewards, None, n, full_states)
+    return compiled_policies[policy]
 
 # initialize pygame with a screen size of 600 by 600
 #pygame.init()
@@ -58,75 +111,45 @@ class Boulder(object):
         #self.image = pygame.transform.scale(pygame.image.load('figs/meteorite.png'),(50,50))
         #screen.blit(self.image, (self.x, self.y))
 
-def T_Alien(n, B):
-    """Creates alien transition matrix for n rows and columns
-    Parameters:
-        n: number of rows/columns
-        B: Boulder transition matrix
-    Returns: Alien transition matrix
-    """
-    empty=lil_matrix((len(state_space), len(state_space))) # sparse matrix for 0s
-    # matrix of boulder transition matrix with 0s for non-alien locations
-    t=[[[empty for row in range(n)] for column in range(n)] for action in range(3)]
-    for i in range(1,n-1):
-        t[0][i][i+1]=B #right
-        t[1][i][i-1]=B #left
-        t[2][i][i]=B #up
-    # End cases
-    t[0][0][1]=B; t[0][n-1][n-1]=B # right
-    t[1][0][0]=B; t[1][n-1][n-2]=B # left
-    t[2][0][0]=B; t[2][n-1][n-1]=B # up
-    return t
-
 class Alien(object):
     """This class handles the movement and creation of the alien agent.
     Attributes:
         draw: adds alien image to screen
         move: moves the alien from state to state
     """
-    def __init__(self, p_values):
-        """Creates alien agent
+    def __init__(self, p_values, position):
+        """Creates alien agent in a screen column
         """
         self.y = p_values[n-1]
-        position=random.randint(0,n-1); self.position=position
+        self.position=position
         self.x=p_values[position]
         #self.image = pygame.transform.scale(pygame.image.load('figs/alien.png'),(50,50))
         #screen.blit(self.image, (self.x, self.y))
-        state_l=['0']*n; state_l[position]='1' #quick alien state generation
-        self.state=''.join(state_l)
+        self.state=n-1-position # alien bit index
 
     def draw(self):
         """Displays alien image"""
         screen.blit(self.image, (self.x, self.y))
 
-    def move(self, event, p_values, T):
-        """Moves the alien right, left or right given an action
+    def move(self, position, p_values):
+        """Moves the alien to the screen column chosen by the environment
         Parameters:
-            event: pygame right, left, or up action
+            position: new screen column
             p_values: dictionary of display coordinates
-            T: Alien transition matrix
         """
-        p_index = {v: k for k, v in p_values.items()} # invert dictionary
-        movement={pygame.K_RIGHT:0, pygame.K_LEFT:1, pygame.K_UP:2} # action options
-        d=movement[event] # converts action to index
-        current_location=p_index[self.x]
-        # Determine next position
-        empty_check=[T[d][current_location][i].count_nonzero() for i in range(n)]
-        new_position=int(np.nonzero(empty_check)[0])
-        # update alien agent
-        self.x=p_values[new_position]; self.position=new_position
-        state_l=['0']*n; state_l[self.position]='1'
-        self.state=''.join(state_l)
+        self.x=p_values[position]; self.position=position
+        self.state=n-1-self.position
         # display alien agent
         #screen.blit(self.image, (self.x, self.y))
 
 def update_boulders(state, p_matrix):
     """Adds all boulders in a given state to the proper positions on the screen
     Parameters:
-        State: Current boulder states
+        State: Current packed boulder state
         p_matrix: position matrix
     Returns: matrix of boulders
     """
+    state=BoulderMatrix.mask_to_state(state, n)
     b_matrix=np.matrix([[int(a) for a in list(b)] for b in [state[i:i+n] for i in range(0,n*n,n)]])
     for x in range(0,n):
         for y in range(0,n):
@@ -143,25 +166,17 @@ def GameLoop(policy):
             Random: Randomly chooses a movement direction
             Greedy: Chooses optimal direction only given next row (ties randomly resolved)
             RL: Reinforcement Learning policy which chooses optimal direction based on entire state
+        The game also ends after max_turns turns.
     Returns: Score and state of death/collision
     """
+    clock = profiler if profile else Instrumentation.DISABLED
+    clock.start()
     state_list=[]
-    with open('PolicyIterationResults/data{}_{}.json'.format(n,n_boulders)) as f: # RL generated policy
-        data = json.load(f)
-        RL_Policies = data['Policy']
-    p_values=calculate_indices(n)
-    p_matrix=np.matrix([[(x,y) for x in list(p_values.values())] for y in list(p_values.values())], dtype=np.dtype('int,int'))
-    boulder_state=state_space[-1] # will be '0'*n so no boulders to start
+    policy_obj = load_policy(policy)
+    state=env.reset() # random alien position and no boulders to start
     #Background() # updates screen with space background
-    alien=Alien(p_values) # initializes alien agent
-    T=T_Alien(n, B)
-
-    if policy=="Random":
-        policy_func = Policies.random_movement
-    elif policy=="Greedy":
-        policy_func = Policies.greedy
-    else:
-        policy_func = Policies.reinforcement_learning
+    alien=Alien(p_values, env.position) # initializes alien agent
+    clock.lap('setup')
 
     running=True; score=0
     while running: # while not dead
@@ -174,52 +189,81 @@ def GameLoop(policy):
 
         #Background()
         # Determine action based on policy
-        event = policy_func(boulder_state, alien.state, movement_rewards, RL_Policies, full_states)
+        action = policy_obj.act(state)
+        clock.lap('decision')
         # update alien position and boudler state with random top row
-        alien.move(event, p_values, T)
-        b_s=random.randint(0,len(b_down[0])-1)
-        boulder_state=index_to_state[b_down[state_to_index[boulder_state]][b_s]]
-        b_matrix=update_boulders(boulder_state, p_matrix)
+        state, reward, done, info = env.step(action)
+        clock.lap('step')
+        alien.move(env.position, p_values)
+        b_matrix=update_boulders(env.boulder_state, p_matrix)
+        clock.lap('update_boulders')
         # test for collision
-        full_state=alien.state+boulder_state; state_list.append(full_state)
-        if full_state in collisions:
+        state_list.append(env.state_string())
+        clock.lap('state log')
+        if done:
             running=False
         else:
             score+=1
+            running=len(state_list)!=max_turns
+        clock.lap('collision')
         #pygame.display.update()
         #time.sleep(delay)
 
+    clock.count('games'); clock.count('turns', len(state_list))
     return score, state_list
 
 def Simulations():
     """Runs simulations of random, greedy, and reinforcement_learning policies.
+    Games are played in batches by BatchSimulation, sharded across n_processes workers,
+    and appended to a trajectory log in SimulationResults as they finish. With ci_width
+    set, each policy stops as soon as its mean score is known to within ci_width, see
+    ParallelSimulation.run_adaptive, and n_iterations only caps the games. When profile
+    is on, profile_games games of each policy are also played through GameLoop and the
+    phase timings of both are reported at the end.
     Parameters: None
     Returns: dictionary of results and exports results.
     """
     results = {}
-    for policy in ["Random", "Greedy", "RL"]:
-        results[policy] = {}
-        policy_score = []; policy_states = []
-        # Create progress bar to measure progress
-        bar = Bar(policy, max=n_iterations, suffix='%(index)d/%(max)d - %(percent).1f%% - %(eta)ds')
-        for i in range(n_iterations):
-            score, states = GameLoop(policy)
-            policy_score.append(score); policy_states.append(states)
-            bar.next()
-        bar.finish()
-        results[policy]['Scores'] = policy_score
-        results[policy]['States'] = policy_states
-
-        print("{} averaged a score of {} over {} turns.".format(policy, sum(policy_score)/n_iterations,n_iterations))
-    pygame.quit()
-    # Save results in SimulationResults
+    if policy_path is None: # given to setup
+        RL_Policies = compiled_policies["RL"].actions
+    else:
+        RL_Policies = np.array(PolicyArtifact.load(policy_path).policy) # RL generated policy
+    policies = ["Random", "Greedy", "RL"]
     now = datetime.datetime.now(); time = now.strftime("%m_%d_%H_%M")
+    path = 'SimulationResults/data{}{}_{}_{}'.format(n,n_boulders, time, n_iterations)
+    batch_clock = Instrumentation.PhaseTimer() if profile else Instrumentation.DISABLED
+    batch_clock.start()
+    with TrajectoryLog.TrajectoryWriter(path+'.trj', n, n_boulders, policies, record_states) as writer:
+        if ci_width is None:
+            played = ParallelSimulation.run(policies, n_iterations, n, n_boulders, RL_Policies, processes=n_processes,
+                                            seed=seed, record_states=record_states, writer=writer, max_turns=max_turns)
+            summary = {policy:writer.stats[policy].summary() for policy in policies}
+        else:
+            played, summary = ParallelSimulation.run_adaptive(policies, ci_width, n_iterations, n, n_boulders, RL_Policies,
+                                                              confidence=confidence, processes=n_processes, seed=seed,
+                                                              record_states=record_states, writer=writer,
+                                                              max_turns=max_turns)
+    batch_clock.lap('batch simulation')
+    for policy in policies:
+        scores, deaths = played[policy]
+        results[policy] = {'Scores':scores.tolist(), 'Stats':summary[policy]}
+        print("{} averaged a score of {} over {} games.".format(policy, summary[policy]['Mean'], summary[policy]['Games']))
+    pygame.quit()
+    # Save summary next to the trajectory log in SimulationResults
     results['Iterations']=n_iterations
-    with open('SimulationResults/data{}{}_{}_{}.json'.format(n,n_boulders, time, n_iterations), 'w') as f:
+    with open(path+'.json', 'w') as f:
         json.dump(results, f)
+    batch_clock.lap('export')
+    if profile:
+        for policy in policies:
+            batch_clock.count('games', len(played[policy][0])); batch_clock.count('turns', int((played[policy][0]+1).sum()))
+            for i in range(profile_games):
+                GameLoop(policy)
+        results['Profile'] = {'Batch':batch_clock.report('Batch simulation'), 'GameLoop':profiler.report('GameLoop')}
     return results
 
 def main():
+    setup(n, n_boulders) # Calculate state matrices
     results = Simulations()
     try:
         t=agfg
@@ -227,4 +271,5 @@ def main():
         winsound.Beep(1500, 1000)
     except:
         pass
-main()
+if __name__ == '__main__':
+    main()
@@ -1,137 +1,68 @@
-from policies import Policies
-from scipy.sparse import lil_matrix
+from policies import Policies, CompiledPolicy
 from progress.bar import Bar
-import BoulderMatrix, MovementRewards, json, pygame, sys, numpy as np, random, time, datetime, os
+import BoulderMatrix, Environment, Instrumentation, ModelCache, PolicyArtifact, Renderer, TrajectoryLog, json, pygame, sys, numpy as np, random, time, datetime, os
 
 # Globals for easy testing
 n=4 # number of rows/columns
 n_boulders=2 # number of boulders/meteorites per row
+gamma=.5 # discount factor of the RL policy
+theta=0.05 # stopping condition of the RL policy
 n_iterations= 1 # number of iterations in the simulation
 delay=0 # adds delay between turns
+profile=False # time each phase of GameLoop and report at the end of Simulations
+headless=False # render with the SDL dummy video driver, for servers without a display
+capture=None # directory for an image sequence, or a .npy file for an array, of every frame
+replay=None # trajectory log (.trj) from SimulationNoVisual to replay instead of simulating
+replay_query={'policy':'RL'} # picks the replayed games, see TrajectoryLog.TrajectoryStore.find
+replay_games=1 # number of matching games to replay
+
+profiler = Instrumentation.PhaseTimer() # phase timings of every profiled game
 
 # Calculate state matrices
-B, b_down, state_to_index, index_to_state, state_space, boulder_positions, alien_positions, collisions, state_reward, full_states = BoulderMatrix.main(n,n_boulders)
-movement_rewards = MovementRewards.main(n, full_states)
+model = ModelCache.load(n, n_boulders) # built once per configuration, then read from the cache
+B, b_down, state_space, boulder_positions, collisions, state_reward, full_states = model.B, model.b_down, model.state_space, model.boulder_positions, model.collisions, model.state_reward, model.full_states
+movement_rewards = model.movement_rewards
+env = Environment.AlienMeteoriteEnv(n, n_boulders, model=model) # reused by every GameLoop
 
-try:
-    fh = open('PolicyIterationResults/data{}_{}.json'.format(n,n_boulders), 'r') # tries to read in policy
+policy_path = PolicyArtifact.artifact_path(n, n_boulders)
+try: # tries to read in a policy solved for these parameters
+    PolicyArtifact.verify(policy_path, n=n, n_boulders=n_boulders, gamma=gamma, theta=theta,
+                          state_hash=PolicyArtifact.state_space_hash(full_states))
 
-except FileNotFoundError: # if fails, optimizes policy for n, n_boulders combinations
+except (FileNotFoundError, PolicyArtifact.CorruptArtifactError): # if missing or unreadable, optimizes policy for n, n_boulders combinations
     import PolicyIteration
     print("Optimizing Policy")
-    PolicyIteration.main(n, n_boulders, b_down, state_to_index, index_to_state, boulder_positions, state_reward, full_states)
+    PolicyIteration.main(n, n_boulders, b_down, boulder_positions, state_reward, full_states,
+                         g=gamma, t=theta)
+except PolicyArtifact.StaleArtifactError: # solved for another gamma or theta, so it is retuned from there
+    import PolicyIteration
+    print("Retuning Policy")
+    PolicyIteration.main(n, n_boulders, b_down, boulder_positions, state_reward, full_states,
+                         g=gamma, t=theta, warm_start=policy_path)
 
-# initialize pygame with a screen size of 600 by 600
-pygame.init()
-screen=pygame.display.set_mode((600, 600))
+compiled_policies = {} # policies are compiled once and reused by every game
 
-def calculate_indices(n):
-    """Calculates the indices for presentation assuming screen size of 600x600.
-    This determines where the boulders and alien will appear on screen.
-    Parameters:
-        n: number of rows/columns. Range(3,7)
-    Returns:
-        dictionary of the screen coordinates
-    """
-    x_y_index=[[int((600/n-50)/2+600/n*i) for i in range(n)] for n in range(3,7)] # calculates indices range [3,6]
-    p_values={}
-    for i in range(n):
-        p_values[i]=x_y_index[n-3][i]
-    return p_values
-
-class Background(object):
-    def __init__(self):
-        """Displays background image on screen of size 600, 600"""
-        self.image = pygame.transform.scale(pygame.image.load('figs/icon.png'),(600,600))
-        screen.blit(self.image, (0, 0))
-
-class Boulder(object):
-    def __init__(self, tup):
-        """Given cordinates, display image of meteorite/boulder
-        Parameters:
-            tup: tuple of x,y coordinates to display boulder/meteorite image
-        Returns: None
-        """
-        self.x=tup[0]; self.y=tup[1]
-        self.image = pygame.transform.scale(pygame.image.load('figs/meteorite.png'),(50,50))
-        screen.blit(self.image, (self.x, self.y))
-
-def T_Alien(n, B):
-    """Creates alien transition matrix for n rows and columns
-    Parameters:
-        n: number of rows/columns
-        B: Boulder transition matrix
-    Returns: Alien transition matrix
-    """
-    empty=lil_matrix((len(state_space), len(state_space))) # sparse matrix for 0s
-    # matrix of boulder transition matrix with 0s for non-alien locations
-    t=[[[empty for row in range(n)] for column in range(n)] for action in range(3)]
-    for i in range(1,n-1):
-        t[0][i][i+1]=B #right
-        t[1][i][i-1]=B #left
-        t[2][i][i]=B #up
-    # End cases
-    t[0][0][1]=B; t[0][n-1][n-1]=B # right
-    t[1][0][0]=B; t[1][n-1][n-2]=B # left
-    t[2][0][0]=B; t[2][n-1][n-1]=B # up
-    return t
-
-class Alien(object):
-    """This class handles the movement and creation of the alien agent.
-    Attributes:
-        draw: adds alien image to screen
-        move: moves the alien from state to state
-    """
-    def __init__(self, p_values):
-        """Creates alien agent
-        """
-        self.y = p_values[n-1]
-        position=random.randint(0,n-1); self.position=position
-        self.x=p_values[position]
-        self.image = pygame.transform.scale(pygame.image.load('figs/alien.png'),(50,50))
-        screen.blit(self.image, (self.x, self.y))
-        state_l=['0']*n; state_l[position]='1' #quick alien state generation
-        self.state=''.join(state_l)
-    def draw(self):
-        """Displays alien image"""
-        screen.blit(self.image, (self.x, self.y))
-
-    def move(self, event, p_values, T):
-        """Moves the alien right, left or right given an action
-        Parameters:
-            event: pygame right, left, or up action
-            p_values: dictionary of display coordinates
-            T: Alien transition matrix
-        """
-        p_index = {v: k for k, v in p_values.items()} # invert dictionary
-        movement={pygame.K_RIGHT:0, pygame.K_LEFT:1, pygame.K_UP:2} # action options
-        d=movement[event] # converts action to index
-        current_location=p_index[self.x]
-        # Determine next position
-        empty_check=[T[d][current_location][i].count_nonzero() for i in range(n)]
-        new_position=int(np.nonzero(empty_check)[0])
-        # update alien agent
-        self.x=p_values[new_position]; self.position=new_position
-        state_l=['0']*n; state_l[self.position]='1'
-        self.state=''.join(state_l)
-        # display alien agent
-        screen.blit(self.image, (self.x, self.y))
-
-def update_boulders(state, p_matrix):
-    """Adds all boulders in a given state to the proper positions on the screen
+def load_policy(policy):
+    """Compiles the Random, Greedy, or RL policy on first use
     Parameters:
-        State: Current boulder states
-        p_matrix: position matrix
-    Returns: matrix of boulders
+        policy: Random, Greedy, GreedyK, or RL
+    Returns: CompiledPolicy
     """
-    b_matrix=np.matrix([[int(a) for a in list(b)] for b in [state[i:i+n] for i in range(0,n*n,n)]])
-    for x in range(0,n):
-        for y in range(0,n):
-            if b_matrix[x,y]==1:
-                loc=p_matrix[x,y]
-                Boulder(loc)
-    return b_matrix
-
+    if policy not in compiled_policies:
+        if policy=="RL":
+            compiled_policies[policy] = CompiledPolicy.load(policy_path)
+        else:
+            compiled_policies[policy] = Policies.compile(policy, movement_rewards, None, n, full_states)
+    return compiled_policies[policy]
+
+# Sprites are loaded and scaled once, and only the cells that change are redrawn
+if capture is None:
+    frames=None
+elif capture.endswith('.npy'):
+    frames=Renderer.ArrayStream(capture)
+else:
+    frames=Renderer.ImageSequence(capture)
+renderer=Renderer.Renderer(n, headless=headless, capture=frames)
 
 def GameLoop(policy):
     """Plays alien-meteorite game where the agent tries to stay alive.
@@ -142,22 +73,13 @@ def GameLoop(policy):
             RL: Reinforcement Learning policy which chooses optimal direction based on entire state
     Returns: Score and state of death/collision
     """
-    with open('PolicyIterationResults/data{}_{}.json'.format(n,n_boulders)) as f: # RL generated policy
-        data = json.load(f)
-        RL_Policies = data['Policy']
-    p_values=calculate_indices(n)
-    p_matrix=np.matrix([[(x,y) for x in list(p_values.values())] for y in list(p_values.values())], dtype=np.dtype('int,int'))
-    boulder_state=state_space[-1] # will be '0'*n so no boulders to start
-    Background() # updates screen with space background
-    alien=Alien(p_values) # initializes alien agent
-    T=T_Alien(n, B)
-
-    if policy=="Random":
-        policy_func = Policies.random_movement
-    elif policy=="Greedy":
-        policy_func = Policies.greedy
-    else:
-        policy_func = Policies.reinforcement_learning
+    clock = profiler if profile else Instrumentation.DISABLED
+    clock.start()
+    policy_obj = load_policy(policy)
+    state=env.reset() # random alien position and no boulders to start
+    renderer.reset() # updates screen with space background
+    renderer.draw(env.position, env.boulder_state)
+    clock.lap('setup')
 
     running=True; score=0; turn=0
     #print(score, turn)
@@ -168,29 +90,32 @@ def GameLoop(policy):
                 running=False
                 pygame.quit()
                 sys.exit()
+        clock.lap('events')
 
-        Background()
         # Determine action based on policy
-        event = policy_func(boulder_state, alien.state, movement_rewards, RL_Policies, full_states)
+        action = policy_obj.act(state)
+        clock.lap('decision')
         # update alien position and boudler state with random top row
-        alien.move(event, p_values, T)
-        b_s=random.randint(0,len(b_down[0])-1)
-        boulder_state=index_to_state[b_down[state_to_index[boulder_state]][b_s]]
-        b_matrix=update_boulders(boulder_state, p_matrix)
+        state, reward, done, info = env.step(action)
+        clock.lap('step')
+        renderer.draw(env.position, env.boulder_state)
+        clock.lap('draw')
         # test for collision
-        full_state=alien.state+boulder_state
-        if full_state in collisions:
+        if done:
             running=False
         else:
             score+=1
-        pygame.display.update()
+        clock.lap('collision')
         time.sleep(delay)
+        clock.lap('delay')
         turn+=1#; print(score, turn)
 
-    return score, full_state
+    clock.count('games'); clock.count('turns', turn)
+    return score, env.state_string()
 
 def Simulations():
     """Runs simulations of random, greedy, and reinforcement_learning policies.
+    When profile is on, the phase timings of every game are reported at the end.
     Parameters: None
     Returns: dictionary of results and exports results.
     """
@@ -209,6 +134,7 @@ def Simulations():
         results[policy]['Deaths'] = policy_death
 
         print("{} averaged a score of {} over {} turns.".format(policy, sum(policy_score)/n_iterations,n_iterations))
+    renderer.close()
     pygame.quit()
     # Save results in SimulationResults
     now = datetime.datetime.now(); time = now.strftime("%m_%d_%H_%M")
@@ -216,8 +142,43 @@ def Simulations():
     with open('SimulationResults/data{}{}_{}_{}.json'.format(n,n_boulders, time, n_iterations), 'w') as f:
         #json.dump(results, f)
         pass
+    if profile:
+        results['Profile'] = profiler.report('GameLoop')
     return results
 
+def Replay(path, query, n_games=1):
+    """Replays logged games without re-simulating them. Only the chosen games are read from the log.
+    Parameters:
+        path: trajectory log written with record_states
+        query: TrajectoryStore.find criteria, ex. {'policy':'Greedy', 'min_score':50}
+        n_games: number of matching games to replay
+    Returns: list of the policy, game id and score of each replayed game
+    """
+    replayed = []
+    with TrajectoryLog.TrajectoryStore(path) as store:
+        if (store.header['n'], store.header['n_boulders']) != (n, n_boulders):
+            raise ValueError('{} was logged for n={} n_boulders={}'.format(path, store.header['n'], store.header['n_boulders']))
+        if not store.header['record_states']:
+            raise ValueError('{} was logged without states'.format(path))
+        nB=len(state_space)
+        for row in store.find(**query)[:n_games]:
+            policy, game, score, states = store.record(row)
+            renderer.reset()
+            for state in states: # full state index alien*nB+boulders
+                for event in pygame.event.get():
+                    if event.type==pygame.QUIT or (event.type==pygame.KEYDOWN and event.key==pygame.K_ESCAPE):
+                        pygame.quit()
+                        sys.exit()
+                renderer.draw(n-1-int(state)//nB, state_space[int(state)%nB])
+                time.sleep(delay)
+            replayed.append((policy, game, score))
+            print("Replayed {} game {} with a score of {}.".format(policy, game, score))
+    renderer.close()
+    pygame.quit()
+    return replayed
+
 def main():
+    if replay is not None:
+        return Replay(replay, replay_query, replay_games)
     results = Simulations()
 main()
@@ -0,0 +1,136 @@
+from policies import CompiledPolicy
+from multiprocessing import Pool
+import BatchSimulation, ModelCache, PolicyArtifact, PolicyIteration, numpy as np
+import argparse, itertools, json, os, time, tracemalloc
+
+# Solves and evaluates a grid of (n, n_boulders, gamma, theta) configurations across a
+# process pool. Every job writes its policy artifact and a .json summary row next to it
+# in SWEEP_DIR. A job whose artifact still matches its parameters and state space is
+# skipped and its saved row reused, so an interrupted or extended sweep only solves
+# what is missing. Models come from ModelCache and are loaded once per (n, n_boulders)
+# before the pool starts, so forked workers share the same memory maps.
+SWEEP_DIR = 'PolicyIterationResults/sweep'
+
+models = {} # ModelCache.Model per (n, n_boulders), loaded once per process
+
+def get_model(n, n_boulders):
+    """Cached model of n, n_boulders, loaded on first use"""
+    if (n, n_boulders) not in models:
+        models[(n, n_boulders)] = ModelCache.load(n, n_boulders)
+    return models[(n, n_boulders)]
+
+def job_path(n, n_boulders, gamma, theta, directory=SWEEP_DIR):
+    """Artifact file of one configuration"""
+    return os.path.join(directory, 'data{}_{}_g{:g}_t{:g}.plc'.format(n, n_boulders, gamma, theta))
+
+def make_jobs(ns, boulders, gammas, thetas, directory=SWEEP_DIR):
+    """Every configuration of the grid with fewer boulders than columns, largest environments first
+    Returns: list of (n, n_boulders, gamma, theta, path)"""
+    jobs = [(n, b, g, t, job_path(n, b, g, t, directory))
+            for n, b, g, t in itertools.product(ns, boulders, gammas, thetas) if b < n]
+    return sorted(jobs, key=lambda job: (-job[0], -job[1])) # long solves start first and short ones fill in
+
+def cached_row(job):
+    """Saved summary row of a finished job, or None when it has to be solved"""
+    n, n_boulders, gamma, theta, path = job
+    try:
+        PolicyArtifact.verify(path, n=n, n_boulders=n_boulders, gamma=gamma, theta=theta,
+                              state_hash=PolicyArtifact.state_space_hash(get_model(n, n_boulders).full_states))
+        with open(path+'.json') as f:
+            return json.load(f)
+    except (FileNotFoundError, PolicyArtifact.StaleArtifactError, PolicyArtifact.CorruptArtifactError,
+            json.JSONDecodeError): # missing, or cut short by a killed job
+        return None
+
+def run_job(job, solver='policy_iteration', n_games=10000, seed=0, max_turns=10000):
+    """Solves one configuration, plays n_games of at most max_turns with the policy and
+    saves the summary row.
+    The solve is timed and traced by tracemalloc in the same run, which adds little to
+    solvers made of array operations.
+    Returns: summary row"""
+    n, n_boulders, gamma, theta, path = job
+    model = get_model(n, n_boulders)
+    tracemalloc.start(); start = time.perf_counter()
+    stats = PolicyIteration.main(n, n_boulders, model.b_down, model.boulder_positions, model.state_reward,
+                                 model.full_states, solver=solver, g=gamma, t=theta, path=path)
+    seconds = time.perf_counter()-start; peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    scores, deaths = BatchSimulation.play(CompiledPolicy.load(path), n_games, n, model.b_down, model.collisions,
+                                          rng=np.random.default_rng(seed), max_turns=max_turns)
+    row = {'n':n, 'n_boulders':n_boulders, 'gamma':gamma, 'theta':theta, 'solver':solver, 'states':len(model.full_states),
+           'iterations':stats['Iterations'], 'solve_seconds':seconds, 'peak_mb':peak/2**20,
+           'games':n_games, 'score':float(scores.mean()), 'score_sem':float(scores.std()/np.sqrt(n_games)),
+           'survived':int((deaths == -1).sum())} # games that reached max_turns
+    with open(path+'.json', 'w') as f:
+        json.dump(row, f)
+    return row
+
+def solve_job(args):
+    """run_job for Pool.imap_unordered, returning the job with its row"""
+    return args[0], run_job(*args)
+
+def run(jobs, processes=None, solver='policy_iteration', n_games=10000, seed=0, max_turns=10000, force=False):
+    """Runs every job that has no matching artifact across a process pool.
+    Parameters:
+        jobs: list from make_jobs
+        processes: number of worker processes, all cores when None, in process when 1
+        solver: PolicyIteration solver
+        n_games: evaluation games per configuration
+        seed: seed of the evaluation games, the same for every configuration
+        max_turns: turn cap of the evaluation games. Policies that never die, ex. one
+            boulder per row on boards wider than 3, score max_turns
+        force: solve every job, even when its artifact is current
+    Returns: list of summary rows in job order
+    """
+    for n, n_boulders in sorted(set(job[:2] for job in jobs)): # built before forking, never twice
+        get_model(n, n_boulders)
+    rows = {} if force else {job:cached_row(job) for job in jobs}
+    todo = [job for job in jobs if rows.get(job) is None]
+    print('{} of {} configurations cached, solving {}'.format(len(jobs)-len(todo), len(jobs), len(todo)))
+    tasks = [(job, solver, n_games, seed, max_turns) for job in todo]
+    if processes == 1 or len(todo) <= 1:
+        finished = map(solve_job, tasks)
+        pool = None
+    else:
+        pool = Pool(processes)
+        finished = pool.imap_unordered(solve_job, tasks)
+    for job, row in finished:
+        rows[job] = row
+        print('Solved n={n} n_boulders={n_boulders} gamma={gamma:g} theta={theta:g} in {solve_seconds:.2f}s'.format(**row))
+    if pool is not None:
+        pool.close(); pool.join()
+    return [rows[job] for job in jobs]
+
+def report(rows):
+    """Prints a table of every summary row"""
+    print('{:>3}{:>3}{:>7}{:>7}{:>10}{:>6}{:>10}{:>10}{:>10}{:>8}{:>10}'.format(
+        'n', 'b', 'gamma', 'theta', 'states', 'iter', 'seconds', 'peak MB', 'score', '+/-', 'survived'))
+    for row in rows:
+        print('{n:>3}{n_boulders:>3}{gamma:>7g}{theta:>7g}{states:>10}{iterations:>6}{solve_seconds:>10.2f}{peak_mb:>10.1f}'
+              '{score:>10.2f}{score_sem:>8.2f}{survived:>10}'.format(**row))
+
+def main():
+    parser = argparse.ArgumentParser(description='Solve and evaluate a grid of environments and discount factors')
+    parser.add_argument('--n', type=int, nargs='+', default=[3, 4], help='numbers of rows/columns')
+    parser.add_argument('--boulders', type=int, nargs='+', default=[1, 2], help='numbers of boulders per row')
+    parser.add_argument('--gamma', type=float, nargs='+', default=[.5])
+    parser.add_argument('--theta', type=float, nargs='+', default=[0.05])
+    parser.add_argument('--solver', default='policy_iteration', choices=sorted(PolicyIteration.SOLVERS))
+    parser.add_argument('--games', type=int, default=10000, help='evaluation games per configuration')
+    parser.add_argument('--processes', type=int, help='worker processes, all cores when omitted')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the evaluation games')
+    parser.add_argument('--max-turns', type=int, default=10000, help='turn cap of the evaluation games')
+    parser.add_argument('--directory', default=SWEEP_DIR, help='where artifacts and summary rows are kept')
+    parser.add_argument('--force', action='store_true', help='solve configurations that are already cached')
+    parser.add_argument('--save', help='write the summary rows to this JSON file')
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.n, args.boulders, args.gamma, args.theta, args.directory)
+    rows = run(jobs, args.processes, args.solver, args.games, args.seed, args.max_turns, args.force)
+    report(rows)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(rows, f, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import BoulderMatrix, numpy as np
+
+# The game looks the same in a mirror: reflecting every row and the alien left to
+# right maps states to states, keeps rewards, and swaps the R and L actions. Solving
+# only one state of each mirror pair and reflecting the policy back is exact.
+SWAP_RL = np.array([1, 0, 2]) # action of the mirrored state, actions ordered RLU
+
+def mirror_rows(n):
+    """Returns a table mapping each row mask of n bits to its reflection"""
+    masks = np.arange(1 << n)
+    return sum(((masks >> i) & 1) << (n-1-i) for i in range(n))
+
+def mirror_states(n, full_states, boulder_positions):
+    """Returns the full state index of the reflection of every full state
+    Parameters:
+        n: number of rows/columns
+        full_states: packed full states, alien << n*n | boulders
+        boulder_positions: possible boulder row masks, empty row last
+    Returns: array of full state indices
+    """
+    full_states = np.asarray(full_states, dtype=np.int64)
+    nB = len(full_states)//n; table = mirror_rows(n)
+    alien = full_states >> (n*n); boulders = full_states & ((1 << (n*n))-1)
+    mirrored = np.zeros(len(full_states), dtype=np.int64)
+    for i in range(n):
+        mirrored |= table[(boulders >> (n*i)) & ((1 << n)-1)] << (n*i)
+    return (n-1-alien)*nB + BoulderMatrix.rank_states(mirrored, n, boulder_positions)
+
+def canonical_states(mirror):
+    """Picks the lower index of every mirror pair as its representative
+    Parameters:
+        mirror: full state index of each state's reflection
+    Returns: representative full state indices and the position of each
+        state's representative among them
+    """
+    canonical = np.minimum(np.arange(len(mirror)), mirror)
+    reps = np.flatnonzero(canonical == np.arange(len(mirror)))
+    return reps, np.searchsorted(reps, canonical)
+
+def expand(actions, V, mirror, column_map):
+    """Expands a policy and value function solved on the representatives to every state
+    Parameters:
+        actions: action index of each representative
+        V: value of each representative
+        mirror: full state index of each state's reflection
+        column_map: position of each state's representative
+    Returns: action index and value of every full state
+    """
+    full_actions = np.asarray(actions)[column_map]
+    reflected = mirror < np.arange(len(mirror)) # states whose representative is their reflection
+    return np.where(reflected, SWAP_RL[full_actions], full_actions), np.asarray(V)[column_map]
@@ -0,0 +1,221 @@
+import numpy as np, json, struct, os, math
+
+# A trajectory log starts with MAGIC, a uint32 header length and a JSON header
+# (n, n_boulders, policies, record_states). Each finished game is then appended as
+# a RECORD (policy id, game id, score, number of states) followed by that many
+# little endian uint32 full state indices. A run that crashes keeps every game
+# written before the crash; read_trajectories stops at a truncated last record.
+# On close the writer also saves an index next to the log, one INDEX_DTYPE row per
+# game with its death state and the file offset of its states, so TrajectoryStore
+# can seek to single games. Logs without an index are indexed by a scan that skips
+# over the states.
+MAGIC = b'ALIENTRJ'
+RECORD = struct.Struct('<BIII')
+INDEX_DTYPE = np.dtype([('policy', 'u1'), ('game', '<u4'), ('score', '<u4'), ('n_states', '<u4'),
+                        ('death', '<u4'), ('offset', '<u8')])
+NO_DEATH = 2**32-1 # death state of games logged without their states or deaths, or that reached the turn cap
+
+class RunningStats(object):
+    """Incremental count, mean, variance, min and max of scores (Welford's method)"""
+    def __init__(self):
+        self.count = 0; self.mean = 0.0; self.m2 = 0.0
+        self.min = math.inf; self.max = -math.inf
+
+    def add_many(self, scores):
+        """Adds an array of scores"""
+        scores = np.asarray(scores, dtype=float)
+        if len(scores) == 0:
+            return
+        count = self.count + len(scores)
+        mean = scores.mean(); delta = mean - self.mean
+        self.m2 += ((scores-mean)**2).sum() + delta**2 * self.count * len(scores) / count
+        self.mean += delta * len(scores) / count
+        self.count = count
+        self.min = min(self.min, scores.min()); self.max = max(self.max, scores.max())
+
+    def variance(self):
+        """Sample variance of the scores so far"""
+        return self.m2 / (self.count-1) if self.count > 1 else 0.0
+
+    def summary(self):
+        """Dictionary of the statistics for json export"""
+        return {'Games':self.count, 'Mean':self.mean, 'Std':math.sqrt(self.variance()),
+                'Min':float(self.min), 'Max':float(self.max)}
+
+class TrajectoryWriter(object):
+    """Appends finished games to a trajectory log and keeps running statistics per policy.
+    Attributes:
+        write: appends a batch of finished games
+        close: flushes and closes the log
+    """
+    def __init__(self, path, n, n_boulders, policies, record_states=True):
+        """Creates the log file and writes its header
+        Parameters:
+            path: log file path, parent directories are created
+            n: number of rows/columns
+            n_boulders: number of boulders/meteorites per row
+            policies: list of policy names, stored by position in each record
+            record_states: store the visited states of every game or only the scores
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path; self.policies = list(policies); self.record_states = record_states
+        self.stats = {policy:RunningStats() for policy in self.policies}
+        self.index = []
+        header = json.dumps({'n':n, 'n_boulders':n_boulders, 'policies':self.policies,
+                             'record_states':record_states}).encode()
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+    def write(self, policy, games, scores, states=None, deaths=None):
+        """Appends finished games
+        Parameters:
+            policy: policy name
+            games: game ids
+            scores: score of each game
+            states: visited full state indices of each game, ignored unless record_states
+            deaths: death state of each game, for the index when states are not recorded.
+                -1 marks a game that reached the turn cap and is logged as NO_DEATH
+        """
+        p = self.policies.index(policy); chunks = []
+        index = np.zeros(len(scores), dtype=INDEX_DTYPE); offset = self.f.tell()
+        for i in range(len(scores)):
+            visited = np.asarray(states[i], dtype='<u4') if self.record_states else np.empty(0, dtype='<u4')
+            chunks.append(RECORD.pack(p, int(games[i]), int(scores[i]), len(visited)))
+            chunks.append(visited.tobytes())
+            offset += RECORD.size
+            index[i] = (p, games[i], scores[i], len(visited), visited[-1] if len(visited) else
+                        (NO_DEATH if deaths is None or deaths[i] < 0 else deaths[i]), offset)
+            offset += visited.nbytes
+        self.f.write(b''.join(chunks)); self.f.flush()
+        self.index.append(index)
+        self.stats[policy].add_many(scores)
+
+    def summary(self):
+        """Running statistics of every policy"""
+        return {policy:stats.summary() for policy, stats in self.stats.items()}
+
+    def close(self):
+        """Closes the log and saves its index"""
+        if self.f.closed:
+            return
+        self.f.close()
+        with open(index_path(self.path), 'wb') as f:
+            np.save(f, np.concatenate(self.index) if self.index else np.zeros(0, dtype=INDEX_DTYPE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def index_path(path):
+    """Index file of a trajectory log"""
+    return path+'.idx'
+
+def read_header(f):
+    """Reads the header of an open trajectory log"""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a trajectory log')
+    length, = struct.unpack('<I', f.read(4))
+    return json.loads(f.read(length))
+
+def read_trajectories(path):
+    """Yields (policy, game, score, states) for every complete record of a trajectory log"""
+    with open(path, 'rb') as f:
+        header = read_header(f)
+        while True:
+            raw = f.read(RECORD.size)
+            if len(raw) < RECORD.size:
+                return
+            p, game, score, n_states = RECORD.unpack(raw)
+            raw = f.read(4*n_states)
+            if len(raw) < 4*n_states:
+                return
+            yield header['policies'][p], game, score, np.frombuffer(raw, dtype='<u4')
+
+def build_index(path):
+    """Indexes every complete record of a trajectory log by reading only the record
+    headers and the last state of each game"""
+    rows = []
+    with open(path, 'rb') as f:
+        read_header(f)
+        size = os.fstat(f.fileno()).st_size
+        while True:
+            raw = f.read(RECORD.size)
+            if len(raw) < RECORD.size:
+                break
+            p, game, score, n_states = RECORD.unpack(raw)
+            offset = f.tell()
+            if offset+4*n_states > size:
+                break
+            death = NO_DEATH
+            if n_states:
+                f.seek(offset+4*(n_states-1)); death, = struct.unpack('<I', f.read(4))
+            f.seek(offset+4*n_states)
+            rows.append((p, game, score, n_states, death, offset))
+    return np.array(rows, dtype=INDEX_DTYPE)
+
+class TrajectoryStore(object):
+    """Random access to single games of a trajectory log.
+    Attributes:
+        header: log header
+        index: INDEX_DTYPE row of every game
+        find: index rows of the games matching a query
+        states: visited states of one game, read without loading the others
+    """
+    def __init__(self, path):
+        """Opens a log with its saved index, or indexes it when the index is missing or older"""
+        self.path = path
+        self.f = open(path, 'rb')
+        self.header = read_header(self.f)
+        idx = index_path(path)
+        if os.path.exists(idx) and os.path.getmtime(idx) >= os.path.getmtime(path):
+            self.index = np.load(idx, mmap_mode='r')
+        else:
+            self.index = build_index(path)
+
+    def __len__(self):
+        return len(self.index)
+
+    def find(self, policy=None, game=None, min_score=None, max_score=None, death=None):
+        """Finds games. Criteria of None are not checked
+        Parameters:
+            policy: policy name
+            game: game id
+            min_score, max_score: inclusive score range
+            death: full state index of the collision
+        Returns: array of index rows
+        """
+        match = np.ones(len(self.index), dtype=bool)
+        if policy is not None:
+            match &= self.index['policy'] == self.header['policies'].index(policy)
+        if game is not None:
+            match &= self.index['game'] == game
+        if min_score is not None:
+            match &= self.index['score'] >= min_score
+        if max_score is not None:
+            match &= self.index['score'] <= max_score
+        if death is not None:
+            match &= self.index['death'] == death
+        return np.flatnonzero(match)
+
+    def states(self, row):
+        """Visited full state indices of the game in an index row"""
+        entry = self.index[row]
+        self.f.seek(int(entry['offset']))
+        return np.frombuffer(self.f.read(4*int(entry['n_states'])), dtype='<u4')
+
+    def record(self, row):
+        """(policy, game, score, states) of the game in an index row"""
+        entry = self.index[row]
+        return self.header['policies'][entry['policy']], int(entry['game']), int(entry['score']), self.states(row)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
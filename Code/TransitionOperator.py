@@ -0,0 +1,82 @@
+import BoulderMatrix, numpy as np
+from scipy.sparse.linalg import LinearOperator
+
+# Moving the boulders down keeps the top n-1 rows as the new bottom n-1 rows and draws
+# one of the K non-empty rows for the top. With the state ids of BoulderMatrix.rank_states,
+# the successor of boulder state b with new row k is k*count_states(n-1, K) + truncated[b],
+# where truncated[b] is the id of b's top n-1 rows among states of n-1 rows. The expected
+# next value is then a reshape, a mean over k and one gather, so no transition is stored.
+
+class TransitionOperator(object):
+    """Matrix free transition model over full state indices alien*nB + b.
+    Attributes:
+        expected_next: [A, S] expected next state value of every action
+        rewards: [A, S] expected reward of every action
+        policy_operator: LinearOperator applying the transitions of a policy
+        operator[a]: LinearOperator applying the transitions of action a
+    """
+    def __init__(self, n, boulder_positions, state_reward=(1, -5), chunk_size=1 << 20):
+        """Computes two small arrays per boulder state, streaming the states in chunks
+        Parameters:
+            n: number of rows/columns
+            boulder_positions: possible boulder row masks, empty row last
+            state_reward: reward of surviving and of colliding
+            chunk_size: boulder states unranked at a time
+        """
+        self.n = n; self.K = len(boulder_positions)-1; self.state_reward = state_reward
+        self.nB = BoulderMatrix.count_states(n, self.K); self.nS = n*self.nB
+        self.block = BoulderMatrix.count_states(n-1, self.K)
+        self.moves = BoulderMatrix.alien_movement_table(n)
+        self.truncated = np.empty(self.nB, dtype=np.int64)
+        self.next_row = np.empty(self.nB, dtype=np.uint8) # row that becomes the bottom row
+        start = 0
+        for states in BoulderMatrix.iter_state_positions(n, boulder_positions, chunk_size):
+            stop = start+len(states)
+            self.truncated[start:stop] = BoulderMatrix.rank_states(states >> n, n, boulder_positions, rows=n-1)
+            self.next_row[start:stop] = (states >> n) & ((1 << n)-1)
+            start = stop
+        self.shape = (self.nS, self.nS)
+
+    def __len__(self):
+        return self.moves.shape[1]
+
+    def next_value(self, V):
+        """[n, block] expected value over the new top row, by alien and truncated state"""
+        V = np.asarray(V).reshape(self.n, self.nB)[:, :self.K*self.block]
+        return V.reshape(self.n, self.K, self.block).mean(axis=1)
+
+    def expected_next(self, V, actions=None):
+        """Expected next state value of every action, or of the given action per state
+        Parameters:
+            V: value of every full state
+            actions: optional action index per state
+        Returns: [A, S] array, or length S array when actions is given
+        """
+        G = self.next_value(V)
+        boulders = np.tile(self.truncated, self.n); aliens = np.repeat(np.arange(self.n), self.nB)
+        if actions is not None:
+            return G[self.moves[aliens, actions], boulders]
+        return np.stack([G[self.moves[aliens, a], boulders] for a in range(len(self))])
+
+    def rewards(self):
+        """[A, S] expected reward of every action. The new bottom row is known before
+        the top row is drawn, so the reward of an action is deterministic"""
+        R = np.empty((len(self), self.nS))
+        rows = self.next_row.astype(np.int64)
+        for alien in range(self.n):
+            for a in range(len(self)):
+                hit = (rows >> self.moves[alien, a]) & 1
+                R[a, alien*self.nB:(alien+1)*self.nB] = np.where(hit, self.state_reward[1], self.state_reward[0])
+        return R
+
+    def __getitem__(self, a):
+        return LinearOperator(self.shape, matvec=lambda V: self.expected_next(V, np.full(self.nS, a)), dtype=float)
+
+    def policy_operator(self, policy):
+        """LinearOperator for the transitions of an [S, A] policy of action probabilities"""
+        policy = np.asarray(policy)
+        deterministic = np.isclose(policy.max(axis=1), 1).all()
+        if deterministic:
+            actions = policy.argmax(axis=1)
+            return LinearOperator(self.shape, matvec=lambda V: self.expected_next(V, actions), dtype=float)
+        return LinearOperator(self.shape, matvec=lambda V: (policy.T*self.expected_next(V)).sum(axis=0), dtype=float)
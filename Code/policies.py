@@ -1,35 +1,93 @@
-import pygame, random
+import MovementRewards, PolicyArtifact, pygame, random, json
 import numpy as np
-import BoulderMatrix
+
+events_options=[pygame.K_RIGHT, pygame.K_LEFT, pygame.K_UP] # action index to pygame event
+
+# Each state stores a uint8 bitmask of the actions the policy may take, bit a for action a.
+# The action is drawn uniformly from the set bits, so a deterministic policy has one bit per state.
+ALL_ACTIONS = 0b111
+N_ALLOWED = np.array([bin(m).count('1') for m in range(8)])
+NTH_ACTION = np.array([[([a for a in range(3) if m >> a & 1]+[0]*3)[k] for k in range(3)] for m in range(8)],
+                      dtype=np.uint8) # k-th allowed action of each bitmask
+
+class CompiledPolicy(object):
+    """Policy compiled to a uint8 array indexed by full state index.
+    Attributes:
+        act: action index for one state
+        act_many: action indices for an array of states
+    """
+    def __init__(self, masks, rng=None):
+        """Creates a policy from allowed action bitmasks
+        Parameters:
+            masks: array of action bitmasks indexed by full state index
+            rng: numpy Generator used to break ties
+        """
+        self.masks = np.asarray(masks, dtype=np.uint8)
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.deterministic = bool((N_ALLOWED[self.masks]==1).all())
+        self.actions = NTH_ACTION[self.masks, 0] # only used when deterministic
+
+    @classmethod
+    def from_actions(cls, actions):
+        """Deterministic policy from an array of action indices"""
+        return cls(np.left_shift(1, np.asarray(actions, dtype=np.uint8)))
+
+    @classmethod
+    def load(cls, path):
+        """Loads a policy artifact, or the 'Policy' list of an older PolicyIterationResults json file"""
+        if path.endswith('.json'):
+            with open(path) as f:
+                return cls.from_actions(json.load(f)['Policy'])
+        return cls.from_actions(PolicyArtifact.load(path).policy)
+
+    def act(self, state, rng=None):
+        """Returns the action index for a full state index"""
+        if self.deterministic:
+            return int(self.actions[state])
+        rng = self.rng if rng is None else rng
+        m = self.masks[state]
+        return int(NTH_ACTION[m, rng.integers(N_ALLOWED[m])])
+
+    def act_many(self, states, rng=None):
+        """Returns the action indices for an array of full state indices"""
+        if self.deterministic:
+            return self.actions[states]
+        rng = self.rng if rng is None else rng
+        m = self.masks[states]
+        return NTH_ACTION[m, (rng.random(len(m))*N_ALLOWED[m]).astype(np.intp)]
 
 class Policies(object):
-    def random_movement(boulder_state, alien_state, movement_rewards, RL_Policies, full_states):
+    def random_movement(nS):
         """Baseline random movement policy"""
-        events_options=[pygame.K_RIGHT, pygame.K_LEFT, pygame.K_UP]
-        ri=random.randint(0,2)
-
-        return events_options[ri]
-    def greedy(boulder_state, alien_state, movement_rewards, RL_Policies, full_states):
-        """Greedy means that it will always take the step to maximize the next moves reward"""
-        events_options=[pygame.K_RIGHT, pygame.K_LEFT, pygame.K_UP]
-        state=alien_state+boulder_state
-        if random.random() > 0:
-            rewards=np.array(movement_rewards[state])
-            try:
-                argmax_indexes=np.where(rewards == 1)[0]
-                movement_index=np.random.choice(np.array(argmax_indexes)) # randomly selects from argmax
-                return events_options[movement_index]
-            except Exception as e:
-                return np.random.choice(events_options)
-        else:
-            return np.random.choice(events_options)
+        return CompiledPolicy(np.full(nS, ALL_ACTIONS))
+
+    def greedy(movement_rewards):
+        """Greedy means that it will always take the step to maximize the next moves reward.
+        Ties are broken randomly and every action is allowed when none survive"""
+        safe = np.asarray(movement_rewards) == 1
+        masks = (safe * np.array([1, 2, 4])).sum(axis=1)
+        return CompiledPolicy(np.where(masks==0, ALL_ACTIONS, masks))
 
+    def greedy_k(lookahead_rewards):
+        """Greedy over a k row horizon. Takes the actions that survive the most of the next
+        k rows, from MovementRewards.lookahead_rewards. Ties are broken randomly"""
+        lookahead_rewards = np.asarray(lookahead_rewards)
+        best = lookahead_rewards == lookahead_rewards.max(axis=1, keepdims=True)
+        return CompiledPolicy((best * np.array([1, 2, 4])).sum(axis=1))
 
-    def reinforcement_learning(boulder_state, alien_state, movement_rewards, RL_Policies, full_states):
-        """RL using value iteration"""
-        alien_state_index, alien_index_state=BoulderMatrix.create_reference_dictionaries(full_states)
-        events_options=[pygame.K_RIGHT, pygame.K_LEFT, pygame.K_UP]
-        state = alien_state + boulder_state
-        RL_i = alien_state_index[state]
-        movement = int(RL_Policies[RL_i])
-        return events_options[movement]
+    def reinforcement_learning(RL_Policies):
+        """RL using policy iteration"""
+        return CompiledPolicy.from_actions(RL_Policies)
+
+    def compile(policy, movement_rewards, RL_Policies, n=None, full_states=None):
+        """Builds the Random, Greedy, GreedyK, or RL policy. GreedyK looks K rows ahead,
+        ex. Greedy3, and needs n and full_states"""
+        if policy=="Random":
+            return Policies.random_movement(len(movement_rewards))
+        elif policy=="Greedy":
+            return Policies.greedy(movement_rewards)
+        elif policy.startswith("Greedy"):
+            k = int(policy[len("Greedy"):])
+            return Policies.greedy_k(MovementRewards.lookahead_rewards(n, full_states, k))
+        else:
+            return Policies.reinforcement_learning(RL_Policies)